@@ -0,0 +1,149 @@
+"""
+Query-plan benchmark for the schema indexes (migration 2).
+
+Builds a synthetic database at the pre-index schema, then times the
+bot's hot queries and prints their EXPLAIN QUERY PLAN before and after
+the migrations run.
+
+    python bench_indexes.py                       # 500k MCQs / 5M scores
+    python bench_indexes.py --mcq 50000 --scores 500000
+"""
+
+import os
+import time
+import random
+import argparse
+import tempfile
+import datetime
+
+from bot_mcq import MIGRATIONS, migrate, open_connection
+
+EXAMS = 20
+TOPICS_PER_EXAM = 25
+USERS = 200_000
+
+today = datetime.date.today()
+
+# (label, sql, params) — copied from the bot's handlers
+HOT_QUERIES = [
+    ("exam_kb", """
+        SELECT DISTINCT exam FROM mcq WHERE is_active=1 ORDER BY exam
+    """, ()),
+    ("topic_kb", """
+        SELECT DISTINCT topic FROM mcq
+        WHERE exam=? AND is_active=1 ORDER BY topic
+    """, ("EXAM_7",)),
+    ("topic_select", """
+        SELECT id FROM mcq WHERE exam=? AND topic=? AND is_active=1
+    """, ("EXAM_7", "TOPIC_7_3")),
+    ("is_duplicate_mcq", """
+        SELECT 1 FROM mcq WHERE exam=? AND topic=? AND question=? LIMIT 1
+    """, ("EXAM_7", "TOPIC_7_3", "Question 123")),
+    ("profile", """
+        SELECT exam, topic, MAX(score), total, MAX(test_date) AS last_date
+        FROM scores WHERE user_id=?
+        GROUP BY exam, topic ORDER BY last_date DESC
+    """, (4242,)),
+    ("leaderboard", """
+        SELECT user_id, MAX(score) AS best FROM scores
+        WHERE exam=? AND topic=?
+        GROUP BY user_id ORDER BY best DESC LIMIT 10
+    """, ("EXAM_7", "TOPIC_7_3")),
+    ("stats_today", """
+        SELECT COUNT(DISTINCT user_id) FROM scores WHERE test_date=?
+    """, (today.isoformat(),)),
+    ("stats_7_days", """
+        SELECT COUNT(DISTINCT user_id) FROM scores WHERE test_date>=?
+    """, ((today - datetime.timedelta(days=7)).isoformat(),)),
+]
+
+
+def build(conn, n_mcq, n_scores, batch=50_000):
+    rnd = random.Random(1)
+
+    def mcq_rows():
+        for i in range(n_mcq):
+            e = rnd.randrange(EXAMS)
+            t = rnd.randrange(TOPICS_PER_EXAM)
+            yield (
+                f"EXAM_{e}", f"TOPIC_{e}_{t}", f"Question {i}",
+                "a", "b", "c", "d", "ABCD"[i % 4], "explanation",
+                0 if t == 0 else 1
+            )
+
+    def score_rows():
+        for _ in range(n_scores):
+            e = rnd.randrange(EXAMS)
+            t = rnd.randrange(TOPICS_PER_EXAM)
+            day = today - datetime.timedelta(days=rnd.randrange(365))
+            yield (
+                rnd.randrange(USERS), f"EXAM_{e}", f"TOPIC_{e}_{t}",
+                rnd.randrange(101), 100, day.isoformat()
+            )
+
+    conn.executemany("""
+        INSERT INTO mcq
+        (exam, topic, question, a, b, c, d, correct, explanation, is_active)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, mcq_rows())
+    conn.executemany("""
+        INSERT INTO scores (user_id, exam, topic, score, total, test_date)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, score_rows())
+    conn.commit()
+
+
+def report(conn, title, repeat=3):
+    print(f"\n===== {title} =====")
+    for label, sql, params in HOT_QUERIES:
+        plan = conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+        best = float("inf")
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            conn.execute(sql, params).fetchall()
+            best = min(best, time.perf_counter() - t0)
+        print(f"{label:<18} {best * 1000:>10.2f} ms")
+        for row in plan:
+            print(f"{'':<20}{row[-1]}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--mcq", type=int, default=500_000)
+    ap.add_argument("--scores", type=int, default=5_000_000)
+    ap.add_argument("--db", help="database path (default: temp file)")
+    args = ap.parse_args()
+
+    path = args.db or tempfile.mktemp(".db")
+    conn = open_connection(path)
+
+    try:
+        migrate(conn, target=1)
+
+        t0 = time.perf_counter()
+        build(conn, args.mcq, args.scores)
+        print(
+            f"Built {args.mcq:,} MCQs / {args.scores:,} scores "
+            f"in {time.perf_counter() - t0:.1f}s → {path}"
+        )
+
+        report(conn, "BEFORE (schema v1, no indexes)")
+
+        t0 = time.perf_counter()
+        version = migrate(conn)
+        print(
+            f"\nMigrated to v{version} "
+            f"({len(MIGRATIONS)} steps) in {time.perf_counter() - t0:.1f}s"
+        )
+
+        report(conn, f"AFTER (schema v{version})")
+    finally:
+        conn.close()
+        if not args.db:
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+
+
+if __name__ == "__main__":
+    main()
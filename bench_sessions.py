@@ -0,0 +1,125 @@
+"""
+Memory benchmark for in-progress exam sessions.
+
+Builds N concurrent sessions in the old user_data layout (list of ids,
+answers dict, materialized attempts / wrong-only lists after finishing)
+and as ExamSession objects (finished ones graded, with review page
+boundaries), and prints the bytes held per session.
+
+    python bench_sessions.py                      # 10k sessions x 100 questions
+    python bench_sessions.py --sessions 50000 --questions 50
+"""
+
+import gc
+import time
+import random
+import argparse
+import datetime
+import tracemalloc
+
+from bot_mcq import ExamSession, review_pages
+
+EXAMS = 20
+TOPICS_PER_EXAM = 25
+BANK = 500_000
+
+# Question text is shared by every session (it lives in question_cache)
+TEXT = ("Question text " * 8, "opt a", "opt b", "opt c", "opt d")
+EXPLANATION = "Explanation " * 10
+
+
+def draw(rnd, questions):
+    e = rnd.randrange(EXAMS)
+    t = rnd.randrange(TOPICS_PER_EXAM)
+    # Strings built per session, as they arrive from callback data
+    exam = "".join(("EXAM_", str(e)))
+    topic = "".join(("TOPIC_", str(e), "_", str(t)))
+    ids = rnd.sample(range(1, BANK), questions)
+    chosen = [rnd.choice("ABCD") if rnd.random() < 0.8 else None for _ in ids]
+    correct = [rnd.choice("ABCD") for _ in ids]
+    return e * TOPICS_PER_EXAM + t, exam, topic, ids, chosen, correct
+
+
+def legacy_session(test_id, exam, topic, ids, chosen, correct, finished):
+    data = {
+        "test_id": test_id,
+        "exam": exam,
+        "topic": topic,
+        "question_ids": list(ids),
+        "total": len(ids),
+        "q_index": 0,
+        "answers": {i: c for i, c in zip(ids, chosen) if c},
+        "started_at": datetime.datetime.utcnow().isoformat()
+    }
+    if finished:
+        answers = data.pop("answers")
+        data.pop("question_ids")
+        attempts = [(i, answers.get(i), c) for i, c in zip(ids, correct)]
+        data.update({
+            "score": sum(a[1] == a[2] for a in attempts),
+            "attempts": attempts,
+            "wrong_only": [a[0] for a in attempts if a[1] != a[2]],
+            "review_index": 0
+        })
+    return data
+
+
+def compact_session(test_id, exam, topic, ids, chosen, correct, finished):
+    s = ExamSession(test_id, exam, topic, ids)
+    for i, c in enumerate(chosen):
+        if c:
+            s.index = i
+            s.choose(c)
+    s.index = 0
+    if finished:
+        rows = {
+            i: (i, exam, topic) + TEXT + (c, EXPLANATION)
+            for i, c in zip(ids, correct)
+        }
+        s.grade(rows)
+        # Page boundaries of the mode being reviewed
+        review_pages(s, "all", s.review_positions("all"), rows)
+    return s
+
+
+def measure(build, specs, finished):
+    gc.collect()
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    held = [build(*spec, finished) for spec in specs]
+    elapsed = time.perf_counter() - t0
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del held
+    return size, elapsed
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--sessions", type=int, default=10_000)
+    ap.add_argument("--questions", type=int, default=100)
+    args = ap.parse_args()
+
+    rnd = random.Random(1)
+    specs = [draw(rnd, args.questions) for _ in range(args.sessions)]
+    print(f"{args.sessions:,} sessions x {args.questions} questions")
+
+    for finished in (False, True):
+        state = "finished (review data)" if finished else "in progress"
+        print(f"\n===== {state} =====")
+        base = None
+        for label, build in (
+            ("dict + list (old)", legacy_session),
+            ("ExamSession", compact_session),
+        ):
+            size, elapsed = measure(build, specs, finished)
+            base = base or size
+            print(
+                f"{label:<20} {size / 2**20:>9.1f} MiB "
+                f"{size / args.sessions:>9,.0f} B/session "
+                f"{base / size:>6.1f}x  ({elapsed:.2f}s)"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -2,92 +2,755 @@
 # PART-1 : CONFIG + DATABASE + CORE HELPERS
 # =====================================================
 
+import io
 import os
+import hmac
+import csv
+import json
+import sys
+import signal
+import queue
+import heapq
+import hashlib
+import contextlib
+import asyncio
 import sqlite3
 import datetime
 import unicodedata
+import random
+import time
 import tempfile
+import itertools
+import multiprocessing
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 import pandas as pd
+from openpyxl import load_workbook
 
 from telegram import (
+    Bot,
     Update,
+    InputFile,
     InlineKeyboardButton,
     InlineKeyboardMarkup
 )
 from telegram.ext import (
     ApplicationBuilder,
+    BaseRateLimiter,
+    BaseUpdateProcessor,
     CommandHandler,
+    TypeHandler,
     CallbackQueryHandler,
     ContextTypes,
     MessageHandler,
     filters
 )
-from telegram.error import BadRequest
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
+
+import tornado.web
+import tornado.httpserver
 
 from reportlab.lib.pagesizes import A4
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.styles import ParagraphStyle
+from reportlab.lib.fonts import addMapping
 from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.cidfonts import UnicodeCIDFont
+from reportlab.pdfbase.ttfonts import TTFont
 
 # ================= CONFIG =================
 TOKEN = os.getenv("BOT_TOKEN") or "PUT_YOUR_BOT_TOKEN_HERE"
 
+# ================= SERVING MODE =================
+# BOT_MODE=polling (default) or webhook (see PART-11)
+BOT_MODE = (os.getenv("BOT_MODE") or "polling").lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")              # public https URL; unset = don't register
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN") or "0.0.0.0"
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT") or 8443)
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH") or "/telegram"
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or hashlib.sha256(TOKEN.encode()).hexdigest()
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS") or 40)
+# Webhook mode only: >1 = dispatcher + N worker processes sharded by user_id
+BOT_WORKERS = int(os.getenv("BOT_WORKERS") or 1)
+
 UPI_ID = "8085692143@ybl"
 
 # 🔐 ADMIN IDS
 ADMIN_IDS = [1977205811]
 
 # ================= DATABASE =================
-conn = sqlite3.connect("mcq.db", check_same_thread=False)
-cur = conn.cursor()
-
-# ---- USERS TABLE ----
-cur.execute("""
-CREATE TABLE IF NOT EXISTS users(
-    user_id INTEGER PRIMARY KEY,
-    username TEXT,
-    first_name TEXT,
-    last_name TEXT,
-    created_at TEXT
-)
-""")
-
-# ---- MCQ TABLE ----
-cur.execute("""
-CREATE TABLE IF NOT EXISTS mcq(
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    exam TEXT,
-    topic TEXT,
-    question TEXT,
-    a TEXT,
-    b TEXT,
-    c TEXT,
-    d TEXT,
-    correct TEXT,
-    explanation TEXT,
-    is_active INTEGER DEFAULT 1
-)
-""")
-
-# ---- SCORES TABLE ----
-cur.execute("""
-CREATE TABLE IF NOT EXISTS scores(
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    user_id INTEGER,
-    exam TEXT,
-    topic TEXT,
-    score INTEGER,
-    total INTEGER,
-    test_date TEXT
+DB_PATH = os.getenv("MCQ_DB_PATH") or "mcq.db"
+
+# Reader connections serve menus / profile / leaderboard in parallel,
+# a single writer connection serialises every write.
+DB_READERS = int(os.getenv("DB_READERS") or 4)
+
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA temp_store=MEMORY",
 )
-""")
 
-conn.commit()
 
-# ================= PDF FONT (UNICODE SAFE) =================
-pdfmetrics.registerFont(UnicodeCIDFont("HeiseiMin-W3"))
+def open_connection(path, readonly=False):
+    """
+    Open a tuned SQLite connection (WAL + NORMAL sync + busy timeout + mmap)
+    """
+    conn = sqlite3.connect(path, timeout=5, check_same_thread=False)
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(pragma)
+    if readonly:
+        conn.execute("PRAGMA query_only=ON")
+    return conn
+
+
+class Database:
+    """
+    Awaitable SQLite connection pool.
+    - writes: one writer connection on a dedicated thread
+    - reads: a small pool of reader connections (WAL lets them run
+      alongside the writer without lock contention)
+    Nothing here ever blocks the event loop.
+    """
+
+    def __init__(self, path, readers=DB_READERS):
+        self.path = path
+        self._writer = None
+        self._readers = queue.SimpleQueue()
+        self._generation = 0
+        self._write_executor = ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix="sqlite-w"
+        )
+        self._read_executor = ThreadPoolExecutor(
+            max_workers=readers,
+            thread_name_prefix="sqlite-r"
+        )
+
+    # ---- worker thread side ----
+
+    def _write_call(self, fn, args):
+        if self._writer is None:
+            self._writer = open_connection(self.path)
+        conn = self._writer
+        try:
+            result = fn(conn, *args)
+            conn.commit()
+            return result
+        except Exception:
+            conn.rollback()
+            raise
+
+    def _read_call(self, fn, args):
+        generation = self._generation
+        try:
+            conn = self._readers.get_nowait()
+        except queue.Empty:
+            conn = open_connection(self.path, readonly=True)
+        try:
+            return fn(conn, *args)
+        finally:
+            if generation == self._generation:
+                self._readers.put(conn)
+            else:
+                conn.close()
+
+    def _close(self):
+        self._generation += 1
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
+
+    # ---- event loop side ----
+
+    async def run(self, fn, *args):
+        """
+        Run fn(conn, *args) on the writer as one transaction
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._write_executor, self._write_call, fn, args
+        )
+
+    async def read(self, fn, *args):
+        """
+        Run fn(conn, *args) on a pooled read-only connection
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._read_executor, self._read_call, fn, args
+        )
+
+    async def fetchone(self, sql, params=()):
+        return await self.read(lambda c: c.execute(sql, params).fetchone())
+
+    async def fetchall(self, sql, params=()):
+        return await self.read(lambda c: c.execute(sql, params).fetchall())
+
+    async def execute(self, sql, params=()):
+        return await self.run(lambda c: c.execute(sql, params).rowcount)
+
+    async def executemany(self, sql, seq):
+        return await self.run(lambda c: c.executemany(sql, seq).rowcount)
+
+    async def close(self):
+        """
+        Close every pooled connection (reopened lazily on next use)
+        """
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._write_executor, self._close)
+
+
+db = Database(DB_PATH)
+
+
+# ================= SCHEMA MIGRATIONS =================
+# Schema version lives in PRAGMA user_version.
+# Each step is idempotent and runs once, in order, inside a transaction.
+# Append new steps at the end — never edit or reorder existing ones.
+
+def _column_exists(conn, table, column):
+    return any(
+        row[1] == column
+        for row in conn.execute(f"PRAGMA table_info({table})")
+    )
+
+
+def _migration_1_base_schema(conn):
+    # ---- USERS TABLE ----
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS users(
+        user_id INTEGER PRIMARY KEY,
+        username TEXT,
+        first_name TEXT,
+        last_name TEXT,
+        created_at TEXT
+    )
+    """)
+
+    # ---- MCQ TABLE ----
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS mcq(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        exam TEXT,
+        topic TEXT,
+        question TEXT,
+        a TEXT,
+        b TEXT,
+        c TEXT,
+        d TEXT,
+        correct TEXT,
+        explanation TEXT,
+        is_active INTEGER DEFAULT 1
+    )
+    """)
+
+    # Very old databases predate the is_active flag
+    if not _column_exists(conn, "mcq", "is_active"):
+        conn.execute("ALTER TABLE mcq ADD COLUMN is_active INTEGER DEFAULT 1")
+
+    # ---- SCORES TABLE ----
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS scores(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        exam TEXT,
+        topic TEXT,
+        score INTEGER,
+        total INTEGER,
+        test_date TEXT
+    )
+    """)
+
+
+def _migration_2_hot_query_indexes(conn):
+    # exam / topic menus + topic_select
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_mcq_exam_topic_active
+        ON mcq(exam, topic, is_active)
+    """)
+    # duplicate detection
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_mcq_exam_topic_question
+        ON mcq(exam, topic, question)
+    """)
+    # profile + duplicate score prevention
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_scores_user_exam_topic
+        ON scores(user_id, exam, topic)
+    """)
+    # leaderboard (covering)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_scores_exam_topic_user
+        ON scores(exam, topic, user_id, score)
+    """)
+    # admin_stats date filters (covering)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_scores_test_date
+        ON scores(test_date, user_id)
+    """)
+    conn.execute("ANALYZE")
+
+
+def _migration_3_tests_table(conn):
+    # Test-level state (enable/disable, size) lives in one small row
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS tests(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        exam TEXT NOT NULL,
+        topic TEXT NOT NULL,
+        is_active INTEGER NOT NULL DEFAULT 1,
+        question_count INTEGER NOT NULL DEFAULT 0,
+        updated_at TEXT,
+        UNIQUE(exam, topic)
+    )
+    """)
+
+    if not _column_exists(conn, "mcq", "test_id"):
+        conn.execute("ALTER TABLE mcq ADD COLUMN test_id INTEGER REFERENCES tests(id)")
+
+    # ---- BACKFILL FROM EXISTING MCQ ROWS ----
+    conn.execute("""
+        INSERT OR IGNORE INTO tests (exam, topic, is_active, question_count, updated_at)
+        SELECT exam, topic, MAX(is_active), COUNT(*), ?
+        FROM mcq
+        GROUP BY exam, topic
+    """, (datetime.datetime.utcnow().isoformat(),))
+    conn.execute("""
+        UPDATE mcq
+        SET test_id = (
+            SELECT t.id FROM tests t
+            WHERE t.exam = mcq.exam AND t.topic = mcq.topic
+        )
+        WHERE test_id IS NULL
+    """)
+
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_mcq_test ON mcq(test_id)")
+
+
+def _migration_4_paper_length(conn):
+    # Questions served per attempt (NULL / 0 = whole test)
+    if not _column_exists(conn, "tests", "paper_length"):
+        conn.execute("ALTER TABLE tests ADD COLUMN paper_length INTEGER")
+
+
+def _migration_5_broadcasts(conn):
+    # Persistent broadcast jobs; `cursor` = last user_id handled
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS broadcasts(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        text TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'running',
+        cursor INTEGER NOT NULL DEFAULT 0,
+        total INTEGER NOT NULL DEFAULT 0,
+        sent INTEGER NOT NULL DEFAULT 0,
+        failed INTEGER NOT NULL DEFAULT 0,
+        admin_chat INTEGER,
+        status_msg INTEGER,
+        created_at TEXT,
+        finished_at TEXT
+    )
+    """)
+
+
+def _migration_6_delivery_status(conn):
+    # reachable=0 once Telegram says the chat is gone (blocked / deleted);
+    # /start sets it back to 1
+    for column, ddl in (
+        ("reachable", "INTEGER NOT NULL DEFAULT 1"),
+        ("unreachable_at", "TEXT"),
+        ("last_delivered", "TEXT"),
+    ):
+        if not _column_exists(conn, "users", column):
+            conn.execute(f"ALTER TABLE users ADD COLUMN {column} {ddl}")
+
+    if not _column_exists(conn, "broadcasts", "unreachable"):
+        conn.execute(
+            "ALTER TABLE broadcasts ADD COLUMN unreachable INTEGER NOT NULL DEFAULT 0"
+        )
+
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_users_unreachable
+        ON users(user_id) WHERE reachable=0
+    """)
+
+
+def _migration_7_broadcast_segments(conn):
+    # ---- maintained activity columns ----
+    if not _column_exists(conn, "users", "last_active"):
+        conn.execute("ALTER TABLE users ADD COLUMN last_active TEXT")
+        conn.execute("""
+            UPDATE users SET last_active=(
+                SELECT MAX(test_date) FROM scores s WHERE s.user_id=users.user_id
+            )
+        """)
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_users_last_active ON users(last_active)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_users_created ON users(created_at)"
+    )
+
+    # ---- per-exam participation ----
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS user_exams(
+        exam TEXT NOT NULL,
+        user_id INTEGER NOT NULL,
+        PRIMARY KEY (exam, user_id)
+    ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        INSERT OR IGNORE INTO user_exams (exam, user_id)
+        SELECT DISTINCT exam, user_id FROM scores
+    """)
+
+    # Low-score segment: (exam, topic) → score + total without table lookups
+    conn.execute("DROP INDEX IF EXISTS idx_scores_exam_topic_user")
+    conn.execute("""
+        CREATE INDEX idx_scores_exam_topic_user
+        ON scores(exam, topic, user_id, score, total)
+    """)
+
+    # ---- recipients resolved once per broadcast ----
+    if not _column_exists(conn, "broadcasts", "segment"):
+        conn.execute("ALTER TABLE broadcasts ADD COLUMN segment TEXT")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS broadcast_recipients(
+        broadcast_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        PRIMARY KEY (broadcast_id, user_id)
+    ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        INSERT OR IGNORE INTO broadcast_recipients (broadcast_id, user_id)
+        SELECT b.id, u.user_id FROM broadcasts b JOIN users u
+        ON u.user_id > b.cursor
+        WHERE b.status='running'
+    """)
+
+    conn.execute("ANALYZE")
+
+
+def _migration_8_meta(conn):
+    # Small shared counters; catalog_version is bumped on every bank edit
+    # so other processes (workers, CLI) know to reload their caches
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS meta(
+        key TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    ) WITHOUT ROWID
+    """)
+    conn.execute(
+        "INSERT OR IGNORE INTO meta (key, value) VALUES ('catalog_version', 0)"
+    )
+
+
+def _migration_9_sessions(conn):
+    # In-progress exams (see SessionStore / ExamSession): ids = array('I')
+    # bytes, answers = one byte per question (0 = unanswered, 1-4 = A-D)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS sessions(
+        user_id INTEGER PRIMARY KEY,
+        test_id INTEGER NOT NULL,
+        ids BLOB NOT NULL,
+        answers BLOB NOT NULL,
+        q_index INTEGER NOT NULL DEFAULT 0,
+        started_at TEXT,
+        updated_at TEXT
+    )
+    """)
+
+
+MIGRATIONS = [
+    _migration_1_base_schema,
+    _migration_2_hot_query_indexes,
+    _migration_3_tests_table,
+    _migration_4_paper_length,
+    _migration_5_broadcasts,
+    _migration_6_delivery_status,
+    _migration_7_broadcast_segments,
+    _migration_8_meta,
+    _migration_9_sessions,
+]
+
+
+def migrate(conn, target=None):
+    """
+    Bring the schema up to `target` (default: latest).
+    Returns the resulting schema version.
+    """
+    target = len(MIGRATIONS) if target is None else target
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+
+    for number, step in enumerate(MIGRATIONS, 1):
+        if number <= version or number > target:
+            continue
+        conn.execute("BEGIN")
+        try:
+            step(conn)
+            conn.execute(f"PRAGMA user_version={number}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        version = number
+
+    return version
+
+# ================= OUTBOUND RATE LIMITER =================
+# Every Bot API call passes through PriorityRateLimiter:
+# - one global budget (Telegram: ~30 msg/s per bot)
+# - per-chat budgets (~1 msg/s private, 20 msg/min groups)
+# - when the global budget is short, waiting calls are served by
+#   priority: interactive edits > documents > bulk (broadcast)
+# - RetryAfter pauses the affected budget and the call is retried
+
+OUTBOUND_RATE = float(os.getenv("OUTBOUND_RATE") or 30)           # msg/s
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE") or 25)         # msg/s
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_DOCUMENT = 1
+PRIORITY_BULK = 2
+
+DOCUMENT_ENDPOINTS = {
+    "sendDocument", "sendPhoto", "sendVideo", "sendAudio", "sendMediaGroup"
+}
+
+
+class TokenBucket:
+    """
+    `rate` tokens per second, bursts up to `capacity`.
+    pause() stalls every waiter on this bucket (Telegram flood wait).
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.resume_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds):
+        self.resume_at = max(self.resume_at, time.monotonic() + seconds)
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.resume_at:
+                    await asyncio.sleep(self.resume_at - now)
+                    continue
+
+                self.tokens = min(
+                    self.capacity,
+                    self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def retry_after_seconds(e: RetryAfter) -> float:
+    delay = e.retry_after
+    if isinstance(delay, datetime.timedelta):
+        delay = delay.total_seconds()
+    return float(delay)
+
+
+class PriorityRateLimiter(BaseRateLimiter):
+    """
+    rate_limit_args: one of the PRIORITY_* constants (optional).
+    Without it, document uploads are PRIORITY_DOCUMENT and everything
+    else PRIORITY_INTERACTIVE.
+    """
+
+    CHAT_BUCKETS = 10000
+
+    def __init__(
+        self,
+        rate=OUTBOUND_RATE,
+        bulk_rate=BROADCAST_RATE,
+        chat_rate=1,
+        chat_burst=5,
+        group_rate=20 / 60,
+        group_burst=3,
+        max_retries=3
+    ):
+        self.rate = rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.max_retries = max_retries
+
+        self._global = TokenBucket(rate)
+        self._bulk = TokenBucket(bulk_rate)
+        self._chats = OrderedDict()
+        self._waiters = []              # heap: (priority, seq, future)
+        self._seq = itertools.count()
+        self._pump = None
+
+        self.waiting = [0, 0, 0]        # per priority
+        self.retries = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        if self._pump is not None:
+            self._pump.cancel()
+            self._pump = None
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if isinstance(chat_id, int) and chat_id > 0:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            else:
+                bucket = TokenBucket(self.group_rate, self.group_burst)
+            self._chats[chat_id] = bucket
+            while len(self._chats) > self.CHAT_BUCKETS:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    async def _run_pump(self):
+        # Hands out global tokens, highest priority first
+        while self._waiters:
+            await self._global.acquire()
+            while self._waiters:
+                _, _, fut = heapq.heappop(self._waiters)
+                if not fut.done():
+                    fut.set_result(None)
+                    break
+
+    async def _acquire_global(self, priority):
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+        if self._pump is None or self._pump.done():
+            self._pump = asyncio.create_task(self._run_pump())
+        await fut
+
+    async def process_request(
+        self, callback, args, kwargs, endpoint, data, rate_limit_args
+    ):
+        # Only outgoing messages count against Telegram's limits
+        if not endpoint.startswith(("send", "edit", "copy", "forward")):
+            return await callback(*args, **kwargs)
+
+        if rate_limit_args is not None:
+            priority = rate_limit_args
+        elif endpoint in DOCUMENT_ENDPOINTS:
+            priority = PRIORITY_DOCUMENT
+        else:
+            priority = PRIORITY_INTERACTIVE
+
+        chat_id = data.get("chat_id")
+        chat = self._chat_bucket(chat_id) if chat_id is not None else None
+
+        for attempt in range(self.max_retries + 1):
+            self.waiting[priority] += 1
+            try:
+                if chat is not None:
+                    await chat.acquire()
+                if priority == PRIORITY_BULK:
+                    await self._bulk.acquire()
+                await self._acquire_global(priority)
+            finally:
+                self.waiting[priority] -= 1
+
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                self.retries += 1
+                delay = retry_after_seconds(e) + 1
+                (chat or self._global).pause(delay)
+                if priority == PRIORITY_BULK:
+                    self._bulk.pause(delay)
+
+
+outbound_limiter = PriorityRateLimiter()
+
+
+# ================= UPDATE PROCESSOR =================
+# Updates are handled concurrently (UPDATE_WORKERS at a time), but each
+# user's updates run one after another, in arrival order, so rapid
+# taps cannot race on ctx.user_data.
+# Only the update at the head of a user's queue holds a worker slot:
+# PTB's own semaphore is left effectively unbounded, because it is taken
+# before do_process_update and would count updates that are merely
+# waiting behind their user's lock.
+
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS") or 64)
+UNBOUNDED_UPDATES = 2 ** 31 - 1
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Concurrent update processing, serialized per user (FIFO asyncio.Lock).
+    Locks exist only while a user has updates in flight.
+    """
+
+    def __init__(self, max_concurrent_updates=UPDATE_WORKERS):
+        super().__init__(UNBOUNDED_UPDATES)
+        self.workers = max_concurrent_updates
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+        self._locks = {}                # user_id -> [lock, pending]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    @staticmethod
+    def _key(update):
+        if isinstance(update, Update):
+            if update.effective_user:
+                return update.effective_user.id
+            if update.effective_chat:
+                return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        key = self._key(update)
+        if key is None:
+            async with self._slots:
+                await coroutine
+            return
+
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+
+        try:
+            async with entry[0], self._slots:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+
+update_processor = PerUserUpdateProcessor()
+
 
 # ================= CORE HELPERS =================
 
@@ -128,16 +791,58 @@ async def safe_edit_or_send(query, text, keyboard=None):
         )
 
 
-def is_duplicate_mcq(exam, topic, question):
+def is_duplicate_mcq(conn, exam, topic, question):
     """
-    DB-level duplicate MCQ detection
+    DB-level duplicate MCQ detection (runs on the DB thread)
     """
-    cur.execute("""
+    row = conn.execute("""
         SELECT 1 FROM mcq
         WHERE exam=? AND topic=? AND question=?
         LIMIT 1
-    """, (exam, topic, question))
-    return cur.fetchone() is not None
+    """, (exam, topic, question)).fetchone()
+    return row is not None
+
+
+def bump_catalog_version(conn):
+    """
+    Mark the MCQ bank as changed for every process sharing the DB
+    """
+    conn.execute(
+        "UPDATE meta SET value = value + 1 WHERE key='catalog_version'"
+    )
+
+
+def read_catalog_version(conn):
+    row = conn.execute(
+        "SELECT value FROM meta WHERE key='catalog_version'"
+    ).fetchone()
+    return row[0] if row else 0
+
+
+def ensure_test(conn, exam, topic):
+    """
+    Return tests.id for exam/topic, creating the test if needed
+    """
+    conn.execute("""
+        INSERT OR IGNORE INTO tests (exam, topic, updated_at)
+        VALUES (?, ?, ?)
+    """, (exam, topic, datetime.datetime.utcnow().isoformat()))
+    return conn.execute(
+        "SELECT id FROM tests WHERE exam=? AND topic=?", (exam, topic)
+    ).fetchone()[0]
+
+
+def recount_tests(conn, test_ids):
+    """
+    Refresh tests.question_count after MCQs were added or removed
+    """
+    now = datetime.datetime.utcnow().isoformat()
+    conn.executemany("""
+        UPDATE tests
+        SET question_count = (SELECT COUNT(*) FROM mcq WHERE test_id = tests.id),
+            updated_at = ?
+        WHERE id = ?
+    """, [(now, test_id) for test_id in set(test_ids)])
 
 
 # ================= COMMON KEYBOARDS =================
@@ -150,24 +855,552 @@ def home_kb():
 # PART-2 : USER EXAM FLOW + SESSION SAFETY
 # =====================================================
 
+# ================= CATALOG CACHE =================
+
+class Catalog:
+    """
+    In-memory exam → active topics → question counts.
+    Built at startup and rebuilt by every code path that mutates the
+    MCQ bank (publish), so exam / topic menu taps never touch the DB.
+    Other processes notice the bumped catalog_version (sync).
+    """
+
+    def __init__(self):
+        self.version = None     # meta.catalog_version this copy was built from
+        self.exams = {}         # exam -> {topic: active question count}
+        self.test_ids = {}      # (exam, topic) -> tests.id
+        self.paper_lengths = {} # tests.id -> questions per attempt (0 = all)
+        self.keyboards = {}     # rendered InlineKeyboardMarkup cache
+
+    async def refresh(self):
+        def load(conn):
+            return read_catalog_version(conn), conn.execute("""
+                SELECT id, exam, topic, question_count, paper_length
+                FROM tests
+                WHERE is_active=1 AND question_count > 0
+                ORDER BY exam, topic
+            """).fetchall()
+
+        version, rows = await db.read(load)
+
+        exams = {}
+        test_ids = {}
+        paper_lengths = {}
+        for test_id, exam, topic, count, length in rows:
+            exams.setdefault(exam, {})[topic] = count
+            test_ids[(exam, topic)] = test_id
+            paper_lengths[test_id] = length or 0
+
+        # Swap in one step: readers never see a half-built catalog
+        self.exams, self.test_ids, self.keyboards = exams, test_ids, {}
+        self.paper_lengths = paper_lengths
+        self.version = version
+
+        # Bank changed: sampling pools are rebuilt on next use
+        sampler.clear()
+
+    async def publish(self):
+        """
+        After editing the bank: bump catalog_version and rebuild
+        """
+        await db.run(bump_catalog_version)
+        await self.refresh()
+
+    async def sync(self):
+        """
+        Rebuild if another process published a change; True if it did
+        """
+        version = await db.read(read_catalog_version)
+        if version == self.version:
+            return False
+        # Edited questions are unknown here → drop the whole cache
+        question_cache.invalidate()
+        await self.refresh()
+        return True
+
+    def test_id(self, exam, topic):
+        return self.test_ids.get((exam, topic))
+
+    def paper_length(self, test_id):
+        return self.paper_lengths.get(test_id, 0)
+
+
+catalog = Catalog()
+
+
+# ================= QUESTION CACHE =================
+
+QUESTION_CACHE_SIZE = int(os.getenv("QUESTION_CACHE_SIZE") or 20000)
+
+# Row layout shared by the question engine, review and PDF:
+# (id, exam, topic, question, a, b, c, d, correct, explanation)
+QUESTION_COLUMNS = "id, exam, topic, question, a, b, c, d, correct, explanation"
+
+
+def fetch_questions(conn, ids, chunk=500):
+    rows = []
+    for i in range(0, len(ids), chunk):
+        part = ids[i:i + chunk]
+        rows += conn.execute(
+            f"SELECT {QUESTION_COLUMNS} FROM mcq "
+            f"WHERE id IN ({','.join('?' * len(part))})",
+            part
+        ).fetchall()
+    return rows
+
+
+class QuestionCache:
+    """
+    Process-wide bounded LRU of MCQ rows keyed by id.
+    Exam sessions hold only ids, so each question is kept in RAM once
+    no matter how many users are taking the test.
+    """
+
+    def __init__(self, maxsize=QUESTION_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._rows = OrderedDict()
+
+    async def get_many(self, ids):
+        """
+        Return {id: row} for ids (rows deleted from the bank are absent)
+        """
+        found = {}
+        missing = []
+        for mcq_id in ids:
+            row = self._rows.get(mcq_id)
+            if row is None:
+                missing.append(mcq_id)
+            else:
+                self._rows.move_to_end(mcq_id)
+                found[mcq_id] = row
+
+        if missing:
+            for row in await db.read(fetch_questions, missing):
+                found[row[0]] = row
+                self._rows[row[0]] = row
+            while len(self._rows) > self.maxsize:
+                self._rows.popitem(last=False)
+
+        return found
+
+    async def get(self, mcq_id):
+        return (await self.get_many([mcq_id])).get(mcq_id)
+
+    def invalidate(self, ids=None):
+        if ids is None:
+            self._rows.clear()
+            return
+        for mcq_id in ids:
+            self._rows.pop(mcq_id, None)
+
+
+question_cache = QuestionCache()
+
+
+# ================= TEST SAMPLER =================
+
+class Sampler:
+    """
+    Per-test MCQ id pools kept in memory as array('I').
+    draw() picks n distinct ids with a partial Fisher–Yates shuffle
+    done in place, so starting a test costs O(paper length), not
+    O(bank size) like ORDER BY RANDOM().
+    """
+
+    def __init__(self):
+        self._pools = {}    # tests.id -> array('I') of mcq ids
+
+    async def draw(self, test_id, n=0):
+        pool = self._pools.get(test_id)
+        if pool is None:
+            rows = await db.fetchall(
+                "SELECT id FROM mcq WHERE test_id=?", (test_id,)
+            )
+            pool = self._pools[test_id] = array("I", (r[0] for r in rows))
+
+        size = len(pool)
+        n = size if n <= 0 else min(n, size)
+
+        for i in range(n):
+            j = random.randrange(i, size)
+            pool[i], pool[j] = pool[j], pool[i]
+
+        return pool[:n].tolist()
+
+    def clear(self):
+        self._pools = {}
+
+
+sampler = Sampler()
+
+
+# ================= EXAM SESSION =================
+
+ANSWER_LETTERS = "ABCD"
+
+
+def positions_buffer(values, n):
+    """
+    Compact read-only sequence of positions 0..n (bytes when they fit)
+    """
+    if n <= 0xFF:
+        return bytes(values)
+    return array("H" if n <= 0xFFFF else "I", values)
+
+
+class ExamSession:
+    """
+    One user's exam, kept compact:
+    - ids:   question ids, array('I')
+    - marks: one byte per question — low nibble = chosen option,
+             high nibble = correct option once graded (1-4 = A-D, 0 = none)
+    - review: graded question positions, built once by grade() and
+              grouped as [correct | wrong incl. skipped | skipped], each
+              group in question order; score and wrong_end mark the
+              group boundaries
+    - pages:  page boundaries of the last reviewed mode (pages_mode),
+              see review_pages, PART-3
+    """
+
+    __slots__ = (
+        "test_id", "exam", "topic", "ids", "marks", "index", "started_at",
+        "score", "touched", "review", "wrong_end", "pages", "pages_mode"
+    )
+
+    def __init__(self, test_id, exam, topic, ids, marks=None, index=0, started_at=None):
+        self.test_id = test_id
+        self.exam = sys.intern(exam)        # one string per exam / topic,
+        self.topic = sys.intern(topic)      # not one per session
+        self.ids = ids if isinstance(ids, array) else array("I", ids)
+        self.marks = marks if marks is not None else bytearray(len(self.ids))
+        self.index = index
+        self.started_at = started_at or time.time()
+        self.score = None       # set by grade()
+        self.review = None      # set by grade()
+        self.wrong_end = 0
+        self.pages = None       # set by review_pages()
+        self.pages_mode = None
+        self.touched = time.monotonic()
+
+    def touch(self):
+        """
+        Called by the question / answer / review screens (idle sweeper)
+        """
+        self.touched = time.monotonic()
+
+    @property
+    def total(self):
+        return len(self.ids)
+
+    @property
+    def finished(self):
+        return self.score is not None
+
+    def current(self):
+        """
+        mcq id at the cursor (None when out of range)
+        """
+        if 0 <= self.index < len(self.ids):
+            return self.ids[self.index]
+        return None
+
+    def chosen(self, i):
+        code = self.marks[i] & 0x0F
+        return ANSWER_LETTERS[code - 1] if code else None
+
+    def choose(self, letter):
+        code = ANSWER_LETTERS.find(letter) + 1
+        if code and not self.finished and self.current() is not None:
+            self.marks[self.index] = (self.marks[self.index] & 0xF0) | code
+
+    def grade(self, rows):
+        """
+        rows: {mcq_id: question row}; questions missing from rows
+        (deleted mid-test) are left out of the result
+        """
+        groups = ([], [], [])
+        for i, mcq_id in enumerate(self.ids):
+            m = rows.get(mcq_id)
+            correct = ANSWER_LETTERS.find(m[8]) + 1 if m is not None else 0
+            self.marks[i] = (self.marks[i] & 0x0F) | (correct << 4)
+            if not correct:
+                continue
+
+            chosen = self.marks[i] & 0x0F
+            if chosen == correct:
+                groups[0].append(i)
+                continue
+            groups[1].append(i)
+            if not chosen:
+                groups[2].append(i)
+
+        correct, wrong, skipped = groups
+        self.score = len(correct)
+        self.wrong_end = len(correct) + len(wrong)      # skipped follow
+        self.review = positions_buffer(correct + wrong + skipped, len(self.ids))
+        self.pages = self.pages_mode = None
+
+        # Read-only from here on; finished sessions are never persisted
+        self.marks = bytes(self.marks)
+        self.started_at = None
+        return self.score, self.graded
+
+    @property
+    def graded(self):
+        return self.wrong_end if self.review is not None else 0
+
+    def review_positions(self, mode):
+        """
+        Question positions shown by a review mode:
+        all, correct, wrong (incl. skipped) or skipped
+        """
+        if self.review is None:
+            return ()
+        if mode == "correct":
+            return self.review[:self.score]
+        if mode == "wrong":
+            return self.review[self.score:self.wrong_end]
+        if mode == "skipped":
+            return self.review[self.wrong_end:]
+        if self.graded == len(self.ids):
+            return range(len(self.ids))
+        # Some questions were deleted mid-test
+        return [i for i, b in enumerate(self.marks) if b >> 4]
+
+    def attempt(self, i):
+        """
+        (mcq_id, chosen, correct) for load_attempts
+        """
+        correct = self.marks[i] >> 4
+        return (
+            self.ids[i],
+            self.chosen(i),
+            ANSWER_LETTERS[correct - 1] if correct else None
+        )
+
+    def to_row(self, user_id):
+        return (
+            user_id,
+            self.test_id,
+            self.ids.tobytes(),
+            bytes(self.marks),
+            self.index,
+            datetime.datetime.utcfromtimestamp(self.started_at).isoformat(),
+            datetime.datetime.utcnow().isoformat(timespec="seconds")
+        )
+
+    @classmethod
+    def from_row(cls, test_id, exam, topic, ids, marks, index, started_at):
+        question_ids = array("I")
+        question_ids.frombytes(ids)
+        try:
+            started = datetime.datetime.fromisoformat(started_at).replace(
+                tzinfo=datetime.timezone.utc
+            ).timestamp()
+        except (TypeError, ValueError):
+            started = None
+        return cls(
+            test_id, exam, topic, question_ids,
+            bytearray(marks), index, started
+        )
+
+
+# ================= SESSION STORE =================
+# In-progress exams survive restarts:
+# - every update marks the user's session dirty (no I/O)
+# - a JobQueue job flushes dirty sessions every SESSION_FLUSH_SECONDS
+#   in one transaction (many taps → one row write)
+# - nothing is loaded at startup; a user's row is read on their first
+#   update after a restart
+# - sessions idle for SESSION_IDLE_TTL are written out and dropped from
+#   memory; the same lazy restore brings them back on the next tap
+
+SESSION_FLUSH_SECONDS = int(os.getenv("SESSION_FLUSH_SECONDS") or 5)
+SESSION_IDLE_TTL = int(os.getenv("SESSION_IDLE_TTL") or 30 * 60)
+SESSION_SWEEP_SECONDS = int(os.getenv("SESSION_SWEEP_SECONDS") or 60)
+
+
+def pack_session(user_id, user_data):
+    """
+    ctx.user_data → sessions row (None when no exam is in progress)
+    """
+    session = user_data.get("session")
+    if session is None or session.finished:
+        return None
+    return session.to_row(user_id)
+
+
+class SessionStore:
+    """
+    Write-behind persistence of exam sessions (sessions table)
+    """
+
+    def __init__(self):
+        self._dirty = {}        # user_id -> user_data (latest state wins)
+        self._checked = set()   # users already looked up since start
+        self._stored = set()    # users known to have a row
+        self._evicted = set()   # users swept while idle
+        self.restored = 0
+        self.flushed = 0
+        self.evicted = 0
+        self.resumed = 0        # evicted sessions brought back by a tap
+
+    def mark(self, user_id, user_data):
+        self._dirty[user_id] = user_data
+
+    async def restore(self, user_id, user_data):
+        """
+        First update from a user since start: reload their exam, if any
+        """
+        if user_id in self._checked:
+            return False
+        self._checked.add(user_id)
+
+        if user_data.get("session"):
+            return False
+
+        row = await db.fetchone("""
+            SELECT s.test_id, t.exam, t.topic, s.ids, s.answers,
+                   s.q_index, s.started_at
+            FROM sessions s JOIN tests t ON t.id = s.test_id
+            WHERE s.user_id=?
+        """, (user_id,))
+        if not row:
+            return False
+
+        self._stored.add(user_id)
+        user_data["session"] = ExamSession.from_row(*row)
+        if user_id in self._evicted:
+            self._evicted.discard(user_id)
+            self.resumed += 1
+        else:
+            self.restored += 1
+        return True
+
+    async def flush(self):
+        if not self._dirty:
+            return 0
+
+        dirty, self._dirty = self._dirty, {}
+        upserts = []
+        deletes = []
+        for user_id, user_data in dirty.items():
+            row = pack_session(user_id, user_data)
+            if row:
+                upserts.append(row)
+                self._stored.add(user_id)
+            elif user_id in self._stored:
+                deletes.append((user_id,))
+                self._stored.discard(user_id)
+
+        if not upserts and not deletes:
+            return 0
+
+        def write(conn):
+            conn.executemany("""
+                INSERT OR REPLACE INTO sessions
+                (user_id, test_id, ids, answers, q_index, started_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, upserts)
+            conn.executemany("DELETE FROM sessions WHERE user_id=?", deletes)
+
+        await db.run(write)
+        self.flushed += len(upserts) + len(deletes)
+        return len(upserts) + len(deletes)
+
+    async def sweep(self, user_data_map, ttl):
+        """
+        Drop sessions idle longer than ttl seconds from memory.
+        Unfinished ones are written first and restored on the next tap;
+        finished ones (result / review screens) are simply dropped.
+        """
+        cutoff = time.monotonic() - ttl
+        idle = []
+        for user_id, user_data in list(user_data_map.items()):
+            session = user_data.get("session")
+            if session is not None and session.touched < cutoff:
+                idle.append((user_id, user_data, session))
+
+        rows = [
+            session.to_row(user_id)
+            for user_id, _, session in idle
+            if not session.finished
+        ]
+        if rows:
+            def write(conn):
+                conn.executemany("""
+                    INSERT OR REPLACE INTO sessions
+                    (user_id, test_id, ids, answers, q_index, started_at, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                """, rows)
+
+            await db.run(write)
+
+        evicted = 0
+        for user_id, user_data, session in idle:
+            # Tapped again while the rows were being written → keep it
+            if user_data.get("session") is not session or session.touched >= cutoff:
+                continue
+            del user_data["session"]
+            user_data.pop("review_mode", None)
+            user_data.pop("review_index", None)
+            self._dirty.pop(user_id, None)
+            self._checked.discard(user_id)
+            if not session.finished:
+                self._stored.add(user_id)
+                self._evicted.add(user_id)
+            evicted += 1
+
+        self.evicted += evicted
+        return evicted
+
+    @staticmethod
+    def live(user_data_map):
+        return sum(1 for d in user_data_map.values() if d.get("session"))
+
+
+sessions = SessionStore()
+
+
+async def session_restore(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    # Handler group -1: runs before every other handler
+    if update.effective_user:
+        await sessions.restore(update.effective_user.id, ctx.user_data)
+
+        # Any update (finish, PDF, back...) keeps the session off the sweep
+        session = ctx.user_data.get("session")
+        if session is not None:
+            session.touch()
+
+
+async def session_autosave(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    # Last handler group: runs after the update changed user_data
+    if update.effective_user:
+        sessions.mark(update.effective_user.id, ctx.user_data)
+
+
+async def session_flush_job(ctx: ContextTypes.DEFAULT_TYPE):
+    await sessions.flush()
+
+
+async def session_sweep_job(ctx: ContextTypes.DEFAULT_TYPE):
+    await sessions.sweep(ctx.application.user_data, SESSION_IDLE_TTL)
+
+
 # ================= EXAM / TOPIC KEYBOARDS =================
 
 def exam_kb():
     """
     Show only exams having at least one ACTIVE MCQ
     """
-    cur.execute("""
-        SELECT DISTINCT exam
-        FROM mcq
-        WHERE is_active=1
-        ORDER BY exam
-    """)
-    rows = cur.fetchall()
+    cached = catalog.keyboards.get("exams")
+    if cached:
+        return cached
 
     kb = []
 
-    if rows:
-        for (exam,) in rows:
+    if catalog.exams:
+        for exam in catalog.exams:
             kb.append([InlineKeyboardButton(exam, callback_data=f"exam::{exam}")])
     else:
         kb.append([InlineKeyboardButton("⚠️ No Active Exams", callback_data="noop")])
@@ -178,27 +1411,25 @@ def exam_kb():
     if ADMIN_IDS:
         kb.append([InlineKeyboardButton("🛠 Admin", callback_data="admin_panel")])
 
-    return InlineKeyboardMarkup(kb)
+    markup = catalog.keyboards["exams"] = InlineKeyboardMarkup(kb)
+    return markup
 
 
 def topic_kb(exam):
     """
     Topics shown only if ACTIVE
     """
-    cur.execute("""
-        SELECT DISTINCT topic
-        FROM mcq
-        WHERE exam=? AND is_active=1
-        ORDER BY topic
-    """, (exam,))
-
-    rows = cur.fetchall()
+    cached = catalog.keyboards.get(("topics", exam))
+    if cached:
+        return cached
 
-    kb = [[InlineKeyboardButton(t[0], callback_data=f"topic::{t[0]}")]
-          for t in rows]
+    kb = [[InlineKeyboardButton(t, callback_data=f"topic::{t}")]
+          for t in catalog.exams.get(exam, {})]
 
     kb.append([InlineKeyboardButton("⬅️ Back", callback_data="home")])
-    return InlineKeyboardMarkup(kb)
+
+    markup = catalog.keyboards[("topics", exam)] = InlineKeyboardMarkup(kb)
+    return markup
 
 
 # ================= START / HOME =================
@@ -206,19 +1437,22 @@ def topic_kb(exam):
 async def start(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
 
-    # Insert user if not exists
-    cur.execute("""
-        INSERT OR IGNORE INTO users
-        (user_id, username, first_name, last_name, created_at)
-        VALUES (?, ?, ?, ?, ?)
+    # Insert user if not exists; a returning user is reachable again
+    today = datetime.date.today().isoformat()
+    await db.execute("""
+        INSERT INTO users
+        (user_id, username, first_name, last_name, created_at, last_active)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE
+        SET reachable=1, unreachable_at=NULL, last_active=excluded.last_active
     """, (
         user.id,
         user.username,
         user.first_name,
         user.last_name,
-        datetime.date.today().isoformat()
+        today,
+        today
     ))
-    conn.commit()
 
     ctx.user_data.clear()
 
@@ -268,17 +1502,14 @@ async def topic_select(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     exam = ctx.user_data.get("exam")
     topic = q.data.split("::", 1)[1]
 
-    # Load active MCQs randomly
-    cur.execute("""
-        SELECT *
-        FROM mcq
-        WHERE exam=? AND topic=? AND is_active=1
-        ORDER BY RANDOM()
-    """, (exam, topic))
+    # Disabled / empty tests are rejected from the catalog, no DB hit
+    question_ids = []
+    test_id = catalog.test_id(exam, topic)
+    if test_id:
+        # Random paper of the configured length (rows come from question_cache)
+        question_ids = await sampler.draw(test_id, catalog.paper_length(test_id))
 
-    questions = cur.fetchall()
-
-    if not questions:
+    if not question_ids:
         await safe_edit_or_send(
             q,
             "⛔ *This test is currently disabled or empty*",
@@ -287,15 +1518,7 @@ async def topic_select(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         return
 
     # SESSION STATE
-    ctx.user_data.update({
-        "exam": exam,
-        "topic": topic,
-        "questions": questions,
-        "total": len(questions),
-        "q_index": 0,
-        "answers": {},          # mcq_id -> A/B/C/D
-        "started_at": datetime.datetime.utcnow().isoformat()
-    })
+    ctx.user_data["session"] = ExamSession(test_id, exam, topic, question_ids)
 
     await show_question(q, ctx)
 
@@ -308,11 +1531,14 @@ async def show_question(q, ctx):
     - highlights selected answer
     - supports skip
     """
-    qs = ctx.user_data.get("questions")
-    idx = ctx.user_data.get("q_index", 0)
-    total = ctx.user_data.get("total", 0)
+    s = ctx.user_data.get("session")
+
+    m = None
+    if s and not s.finished and s.current() is not None:
+        s.touch()
+        m = await question_cache.get(s.current())
 
-    if not qs or idx < 0 or idx >= total:
+    if m is None:
         await safe_edit_or_send(
             q,
             "⚠️ *Session expired or invalid.*\n\nPlease start again.",
@@ -321,9 +1547,8 @@ async def show_question(q, ctx):
         ctx.user_data.clear()
         return
 
-    m = qs[idx]
-    mcq_id = m[0]
-    selected = ctx.user_data["answers"].get(mcq_id)
+    idx, total = s.index, s.total
+    selected = s.chosen(idx)
 
     def opt(label, value):
         return f"✅ {value}" if selected == label else value
@@ -376,14 +1601,12 @@ async def answer(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
 
     sel = q.data.split("::", 1)[1]
 
-    qs = ctx.user_data.get("questions")
-    idx = ctx.user_data.get("q_index", 0)
-
-    if not qs:
+    s = ctx.user_data.get("session")
+    if not s or s.finished:
         return
 
-    mcq_id = qs[idx][0]
-    ctx.user_data["answers"][mcq_id] = sel
+    s.touch()
+    s.choose(sel)
 
     await show_question(q, ctx)
 
@@ -394,8 +1617,9 @@ async def next_q(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
 
-    if "q_index" in ctx.user_data:
-        ctx.user_data["q_index"] += 1
+    s = ctx.user_data.get("session")
+    if s and not s.finished:
+        s.index += 1
 
     await show_question(q, ctx)
 
@@ -404,28 +1628,139 @@ async def prev_q(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
 
-    if "q_index" in ctx.user_data:
-        ctx.user_data["q_index"] -= 1
+    s = ctx.user_data.get("session")
+    if s and not s.finished:
+        s.index -= 1
 
     await show_question(q, ctx)
 # =====================================================
 # PART-3 : RESULT + REVIEW SYSTEM
 # =====================================================
 
-REVIEW_PAGE_SIZE = 5   # Telegram safe pagination
+# Review pages are packed greedily up to REVIEW_PAGE_CHARS (UTF-16 units,
+# as Telegram counts them); long entries get fewer per page, short ones more
+TELEGRAM_MESSAGE_LIMIT = 4096
+REVIEW_HEADER_CHARS = 64    # title + "Page x / y"
+REVIEW_PAGE_CHARS = min(
+    int(os.getenv("REVIEW_PAGE_CHARS") or 3800),
+    TELEGRAM_MESSAGE_LIMIT - REVIEW_HEADER_CHARS
+)
 
 
-# ================= FINISH TEST =================
+def message_length(text):
+    """
+    Length as Telegram counts it (UTF-16 code units)
+    """
+    return len(text.encode("utf-16-le")) // 2
 
-async def finish_test(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
-    q = update.callback_query
-    await q.answer()
 
-    qs = ctx.user_data.get("questions")
-    answers = ctx.user_data.get("answers", {})
+def clip_text(text, limit):
+    """
+    Longest prefix of text within `limit` UTF-16 units (bisect: emoji
+    and other non-BMP characters count twice)
+    """
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if message_length(text[:mid]) <= limit:
+            lo = mid
+        else:
+            hi = mid - 1
+    return text[:lo]
 
-    if not qs:
-        await safe_edit_or_send(
+
+def review_entry(n, a, clip=True):
+    """
+    One question on a review page; clipped so a single entry always fits
+    """
+    text = (
+        f"*Q{n}.* {a['question']}\n"
+        f"Your Answer: {a['chosen']}\n"
+        f"Correct Answer: *{a['correct']}*\n"
+        f"📘 {a['explanation']}\n\n"
+    )
+    over = message_length(text) - REVIEW_PAGE_CHARS
+    if over <= 0 or not clip:
+        return text
+
+    # Trim the explanation first, then the question, then the answers;
+    # the fixed labels alone always fit, so the result is within budget
+    for field in ("explanation", "question", "chosen", "correct"):
+        value = a[field]
+        size = message_length(value)
+        clipped = clip_text(value, size - over - 1)     # 1 for "…"
+        over -= size - message_length(clipped) - 1
+        a = dict(a, **{field: clipped + "…"})
+        if over <= 0:
+            break
+    return review_entry(n, a, clip=False)
+
+
+def review_pages(s, mode, positions, rows):
+    """
+    Page boundaries for one review mode, kept on the session until the
+    user switches mode: [0, end of page 1, end of page 2, ...]
+    """
+    bounds = [0]
+    used = 0
+    for k, i in enumerate(positions):
+        m = rows.get(s.ids[i])
+        if m is None:   # deleted since the test was finished
+            continue
+        # Widest "Q<n>" the entry can get, so numbering never overflows
+        size = message_length(
+            review_entry(len(positions), attempt_view(m, s.chosen(i)))
+        )
+        if used and used + size > REVIEW_PAGE_CHARS:
+            bounds.append(k)
+            used = 0
+        used += size
+    if positions:
+        bounds.append(len(positions))
+
+    s.pages = positions_buffer(bounds, len(positions))
+    s.pages_mode = mode
+    return s.pages
+
+
+def attempt_view(row, chosen):
+    """
+    Review / PDF view of one answered question
+    """
+    return {
+        "question": row[3],
+        "chosen": row[4 + "ABCD".index(chosen)] if chosen else "Not Attempted",
+        "correct": row[4 + "ABCD".index(row[8])],
+        "explanation": row[9]
+    }
+
+
+async def load_attempts(attempts):
+    """
+    attempts: [(mcq_id, chosen, correct)] → full views via question_cache
+    """
+    rows = await question_cache.get_many([a[0] for a in attempts])
+    return [
+        attempt_view(rows[mcq_id], chosen)
+        for mcq_id, chosen, _ in attempts
+        if mcq_id in rows
+    ]
+
+
+# ================= FINISH TEST =================
+
+async def finish_test(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    await q.answer()
+
+    s = ctx.user_data.get("session")
+
+    if s and s.finished:        # double-tapped Finish
+        await show_result(q, ctx)
+        return
+
+    if not s:
+        await safe_edit_or_send(
             q,
             "⚠️ *Session expired.*\nPlease start again.",
             home_kb()
@@ -433,68 +1768,70 @@ async def finish_test(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         ctx.user_data.clear()
         return
 
-    score = 0
-    attempts = []
-    wrong_only = []
+    rows = await question_cache.get_many(s.ids)
+    if s.finished:              # scored by a concurrent tap meanwhile
+        await show_result(q, ctx)
+        return
 
-    for m in qs:
-        mcq_id = m[0]
-        chosen = answers.get(mcq_id)
-        correct = m[8]
+    # Grades in place; review positions are grouped once here
+    score, total = s.grade(rows)
+
+    def save_score(conn, user_id, exam, topic):
+        # 🔐 DUPLICATE SCORE PREVENTION
+        conn.execute("""
+            DELETE FROM scores
+            WHERE user_id=? AND exam=? AND topic=?
+        """, (user_id, exam, topic))
+
+        today = datetime.date.today().isoformat()
+        conn.execute("""
+            INSERT INTO scores
+            VALUES (NULL, ?, ?, ?, ?, ?, ?)
+        """, (
+            user_id,
+            exam,
+            topic,
+            score,
+            total,
+            today
+        ))
 
-        if chosen == correct:
-            score += 1
-        else:
-            wrong_only.append(m)
+        # Broadcast segments (PART-10)
+        conn.execute(
+            "UPDATE users SET last_active=? WHERE user_id=?", (today, user_id)
+        )
+        conn.execute(
+            "INSERT OR IGNORE INTO user_exams (exam, user_id) VALUES (?, ?)",
+            (exam, user_id)
+        )
 
-        attempts.append({
-            "question": m[3],
-            "chosen": m[4 + "ABCD".index(chosen)] if chosen else "Not Attempted",
-            "correct": m[4 + "ABCD".index(correct)],
-            "explanation": m[9]
-        })
+    await db.run(save_score, q.from_user.id, s.exam, s.topic)
 
-    total = len(qs)
+    ctx.user_data["review_index"] = 0
 
-    # 🔐 DUPLICATE SCORE PREVENTION
-    cur.execute("""
-        DELETE FROM scores
-        WHERE user_id=? AND exam=? AND topic=?
-    """, (
-        q.from_user.id,
-        ctx.user_data["exam"],
-        ctx.user_data["topic"]
-    ))
+    await show_result(q, ctx)
 
-    cur.execute("""
-        INSERT INTO scores
-        VALUES (NULL, ?, ?, ?, ?, ?, ?)
-    """, (
-        q.from_user.id,
-        ctx.user_data["exam"],
-        ctx.user_data["topic"],
-        score,
-        total,
-        datetime.date.today().isoformat()
-    ))
-    conn.commit()
 
-    # STORE REVIEW DATA
-    ctx.user_data.update({
-        "score": score,
-        "total": total,
-        "attempts": attempts,
-        "wrong_only": wrong_only,
-        "review_index": 0
-    })
+async def show_result(q, ctx):
+    s = ctx.user_data.get("session")
+    if not s or not s.finished:
+        await safe_edit_or_send(
+            q,
+            "⚠️ *Session expired.*\nPlease start again.",
+            home_kb()
+        )
+        return
 
     await safe_edit_or_send(
         q,
         f"🎯 *Test Completed*\n\n"
-        f"Score: *{score} / {total}*",
+        f"Score: *{s.score} / {s.graded}*",
         InlineKeyboardMarkup([
             [InlineKeyboardButton("📋 Review All", callback_data="review_all")],
-            [InlineKeyboardButton("❌ Wrong Only", callback_data="review_wrong")],
+            [
+                InlineKeyboardButton("❌ Wrong Only", callback_data="review_wrong"),
+                InlineKeyboardButton("⏭ Skipped Only", callback_data="review_skipped")
+            ],
             [InlineKeyboardButton("📄 Download PDF", callback_data="pdf_result")],
             [InlineKeyboardButton("🏠 Home", callback_data="home")]
         ])
@@ -523,21 +1860,38 @@ async def review_wrong(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     await show_review(q, ctx)
 
 
+async def review_skipped(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    await q.answer()
+
+    ctx.user_data["review_mode"] = "skipped"
+    ctx.user_data["review_index"] = 0
+
+    await show_review(q, ctx)
+
+
 # ================= REVIEW RENDER =================
 
+REVIEW_TITLES = {
+    "all": "📋 *Review All*",
+    "wrong": "❌ *Wrong Questions*",
+    "skipped": "⏭ *Skipped Questions*",
+}
+
+
 async def show_review(q, ctx):
     mode = ctx.user_data.get("review_mode")
     index = ctx.user_data.get("review_index", 0)
 
-    if mode == "wrong":
-        data = [
-            a for a in ctx.user_data["attempts"]
-            if a["chosen"] != a["correct"]
-        ]
-        title = "❌ *Wrong Questions*"
-    else:
-        data = ctx.user_data.get("attempts", [])
-        title = "📋 *Review All*"
+    s = ctx.user_data.get("session")
+    if s:
+        s.touch()
+
+    # Question positions for this mode, slices of the graded positions
+    if mode not in REVIEW_TITLES:
+        mode = "all"
+    data = s.review_positions(mode) if s and s.finished else ()
+    title = REVIEW_TITLES[mode]
 
     if not data:
         await safe_edit_or_send(
@@ -550,20 +1904,24 @@ async def show_review(q, ctx):
         )
         return
 
-    total_pages = (len(data) - 1) // REVIEW_PAGE_SIZE + 1
-    start = index * REVIEW_PAGE_SIZE
-    end = start + REVIEW_PAGE_SIZE
-    page = data[start:end]
-
-    text = f"{title}\n\nPage *{index+1} / {total_pages}*\n\n"
-
-    for i, a in enumerate(page, start + 1):
-        text += (
-            f"*Q{i}.* {a['question']}\n"
-            f"Your Answer: {a['chosen']}\n"
-            f"Correct Answer: *{a['correct']}*\n"
-            f"📘 {a['explanation']}\n\n"
-        )
+    # Page boundaries: measured once per mode, reused by Next / Prev
+    if s.pages_mode == mode:
+        bounds = s.pages
+    else:
+        rows = await question_cache.get_many([s.ids[i] for i in data])
+        bounds = review_pages(s, mode, data, rows)
+
+    total_pages = len(bounds) - 1
+    index = max(0, min(index, total_pages - 1))
+    ctx.user_data["review_index"] = index
+    start, end = bounds[index], bounds[index + 1]
+    page = await load_attempts([s.attempt(i) for i in data[start:end]])
+
+    parts = [f"{title}\n\nPage *{index+1} / {total_pages}*\n\n"]
+    parts.extend(
+        review_entry(n, a) for n, a in enumerate(page, start + 1)
+    )
+    text = "".join(parts)
 
     kb = []
     nav = []
@@ -590,6 +1948,10 @@ async def review_next(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
 
+    if "review_index" not in ctx.user_data:     # session swept while idle
+        await show_result(q, ctx)
+        return
+
     ctx.user_data["review_index"] += 1
     await show_review(q, ctx)
 
@@ -598,6 +1960,10 @@ async def review_prev(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
 
+    if "review_index" not in ctx.user_data:     # session swept while idle
+        await show_result(q, ctx)
+        return
+
     ctx.user_data["review_index"] -= 1
     await show_review(q, ctx)
 
@@ -608,51 +1974,92 @@ async def back_result(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
 
-    await safe_edit_or_send(
-        q,
-        f"🎯 *Test Completed*\n\n"
-        f"Score: *{ctx.user_data.get('score')} / {ctx.user_data.get('total')}*",
-        InlineKeyboardMarkup([
-            [InlineKeyboardButton("📋 Review All", callback_data="review_all")],
-            [InlineKeyboardButton("❌ Wrong Only", callback_data="review_wrong")],
-            [InlineKeyboardButton("📄 Download PDF", callback_data="pdf_result")],
-            [InlineKeyboardButton("🏠 Home", callback_data="home")]
-        ])
-    )
+    await show_result(q, ctx)
 # =====================================================
 # PART-4 : PDF RESULT GENERATION (UNICODE SAFE)
 # =====================================================
 
 # NOTE:
-# - Uses reportlab + Unicode CID font (already registered in PART-1)
-# - Generates per-user, per-test temporary PDF
+# - Uses reportlab + bundled Devanagari TTFs (registered on first render)
+# - Generates per-user, per-test PDF in memory (no temp files)
 # - Safe for Hindi + English text
+# - Rendering is pure CPU: it runs in a bounded process pool (PdfRenderer)
+# - Uploaded PDFs are re-sent by Telegram file_id (PdfFileCache)
+
+PDF_WORKERS = int(os.getenv("PDF_WORKERS") or 2)
+PDF_MAX_QUEUE = int(os.getenv("PDF_MAX_QUEUE") or 50)
+PDF_FILE_CACHE_SIZE = int(os.getenv("PDF_FILE_CACHE_SIZE") or 10000)
+
+# ================= PDF FONT (UNICODE SAFE) =================
+
+FONT_DIR = os.path.dirname(os.path.abspath(__file__))
+PDF_FONT = "MCQSans"
+PDF_FONT_FILES = {
+    PDF_FONT: ("NotoSansDevanagari-Regular.ttf", "Mangal.ttf"),
+    PDF_FONT + "-Bold": ("mangalb.ttf",),
+}
+
+_pdf_style = None
+
+
+def pdf_style():
+    """
+    Paragraph style for result PDFs.
+    First call (per process) registers the bundled TTFs — TTFont embeds
+    only the glyphs actually used — and the style is reused afterwards.
+    """
+    global _pdf_style
+    if _pdf_style is not None:
+        return _pdf_style
+
+    for name, files in PDF_FONT_FILES.items():
+        path = next(
+            (os.path.join(FONT_DIR, f) for f in files
+             if os.path.exists(os.path.join(FONT_DIR, f))),
+            None
+        )
+        if path is None:
+            raise FileNotFoundError(f"PDF font missing: {' / '.join(files)}")
+        pdfmetrics.registerFont(TTFont(name, path))
+
+    # <b> inside Paragraph → bold face of the same family
+    bold = PDF_FONT + "-Bold"
+    addMapping(PDF_FONT, 0, 0, PDF_FONT)
+    addMapping(PDF_FONT, 1, 0, bold)
+    addMapping(PDF_FONT, 0, 1, PDF_FONT)
+    addMapping(PDF_FONT, 1, 1, bold)
+
+    _pdf_style = ParagraphStyle(
+        "MCQNormal",
+        fontName=PDF_FONT,
+        fontSize=10,
+        leading=14
+    )
+    return _pdf_style
 
 
-def generate_result_pdf(user, exam, topic, score, total, attempts):
+def generate_result_pdf(name, exam, topic, score, total, attempts):
     """
-    Create a Unicode-safe PDF result file and return file path
+    Create a Unicode-safe PDF result and return its bytes
+    (runs in a worker process — arguments must be picklable)
     """
-    tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf")
-    pdf_path = tmp.name
-    tmp.close()
+    buf = io.BytesIO()
 
-    doc = SimpleDocTemplate(pdf_path, pagesize=A4)
-    styles = getSampleStyleSheet()
-    styles["Normal"].fontName = "HeiseiMin-W3"
+    doc = SimpleDocTemplate(buf, pagesize=A4)
+    style = pdf_style()
 
     story = []
 
     # ---------- HEADER ----------
-    story.append(Paragraph(f"<b>Exam:</b> {safe_text(exam)}", styles["Normal"]))
-    story.append(Paragraph(f"<b>Topic:</b> {safe_text(topic)}", styles["Normal"]))
+    story.append(Paragraph(f"<b>Exam:</b> {safe_text(exam)}", style))
+    story.append(Paragraph(f"<b>Topic:</b> {safe_text(topic)}", style))
     story.append(Paragraph(
-        f"<b>User:</b> {safe_text(display_name(user))}",
-        styles["Normal"]
+        f"<b>User:</b> {safe_text(name)}",
+        style
     ))
     story.append(Paragraph(
         f"<b>Score:</b> {score} / {total}",
-        styles["Normal"]
+        style
     ))
     story.append(Spacer(1, 12))
 
@@ -660,25 +2067,139 @@ def generate_result_pdf(user, exam, topic, score, total, attempts):
     for i, a in enumerate(attempts, 1):
         story.append(Paragraph(
             f"<b>Q{i}.</b> {safe_text(a['question'])}",
-            styles["Normal"]
+            style
         ))
         story.append(Paragraph(
             f"<b>Your Answer:</b> {safe_text(a['chosen'])}",
-            styles["Normal"]
+            style
         ))
         story.append(Paragraph(
             f"<b>Correct Answer:</b> {safe_text(a['correct'])}",
-            styles["Normal"]
+            style
         ))
         story.append(Paragraph(
             f"<b>Explanation:</b> {safe_text(a['explanation'])}",
-            styles["Normal"]
+            style
         ))
         story.append(Spacer(1, 12))
 
     # ---------- BUILD ----------
     doc.build(story)
-    return pdf_path
+    return buf.getvalue()
+
+
+# ================= PDF WORKER POOL =================
+
+class PdfRenderer:
+    """
+    Bounded ProcessPoolExecutor for generate_result_pdf.
+    At most PDF_WORKERS renders run at once, up to PDF_MAX_QUEUE more
+    wait their turn; beyond that requests are refused.
+    A pool whose worker died is dropped and recreated on the next render.
+    """
+
+    def __init__(self, workers=PDF_WORKERS, max_queue=PDF_MAX_QUEUE):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.running = 0
+        self.waiting = 0
+        self.peak_waiting = 0
+        self.rendered = 0
+        self.rejected = 0
+        self.restarts = 0
+        self._slots = asyncio.Semaphore(workers)
+        self._pool = None
+
+    def _executor(self):
+        # Created on first use; spawn (not fork) — the parent runs threads
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._pool
+
+    async def render(self, *args):
+        """
+        Await generate_result_pdf(*args); None when the queue is full
+        or the pool broke (worker killed / crashed)
+        """
+        if self.waiting >= self.max_queue:
+            self.rejected += 1
+            return None
+
+        self.waiting += 1
+        self.peak_waiting = max(self.peak_waiting, self.waiting)
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+
+        self.running += 1
+        pool = self._executor()
+        try:
+            loop = asyncio.get_running_loop()
+            data = await loop.run_in_executor(pool, generate_result_pdf, *args)
+            self.rendered += 1
+            return data
+        except BrokenProcessPool:
+            # Every later submit would fail too: start a fresh pool next time
+            if self._pool is pool:
+                self._pool = None
+                self.restarts += 1
+                pool.shutdown(wait=False, cancel_futures=True)
+            return None
+        finally:
+            self.running -= 1
+            self._slots.release()
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+
+pdf_renderer = PdfRenderer()
+
+
+# ================= PDF FILE_ID CACHE =================
+
+def pdf_content_key(*args):
+    """
+    Hash of everything that ends up in the PDF (generate_result_pdf args)
+    """
+    return hashlib.sha256(repr(args).encode("utf-8")).hexdigest()
+
+
+class PdfFileCache:
+    """
+    LRU: content hash → Telegram file_id of an already uploaded PDF.
+    A hit is re-sent by file_id: no render, no upload.
+    """
+
+    def __init__(self, size=PDF_FILE_CACHE_SIZE):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._ids = OrderedDict()
+
+    def get(self, key):
+        file_id = self._ids.get(key)
+        if file_id is None:
+            self.misses += 1
+            return None
+        self._ids.move_to_end(key)
+        self.hits += 1
+        return file_id
+
+    def put(self, key, file_id):
+        self._ids[key] = file_id
+        self._ids.move_to_end(key)
+        while len(self._ids) > self.size:
+            self._ids.popitem(last=False)
+
+
+pdf_file_cache = PdfFileCache()
 
 
 # ================= PDF CALLBACK =================
@@ -688,7 +2209,8 @@ async def pdf_result(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     await q.answer()
 
     # Session safety
-    if "attempts" not in ctx.user_data:
+    s = ctx.user_data.get("session")
+    if not s or not s.finished:
         await safe_edit_or_send(
             q,
             "⚠️ *Session expired.* Please take the test again.",
@@ -696,27 +2218,41 @@ async def pdf_result(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         )
         return
 
-    path = generate_result_pdf(
-        user=q.from_user,
-        exam=ctx.user_data.get("exam"),
-        topic=ctx.user_data.get("topic"),
-        score=ctx.user_data.get("score"),
-        total=ctx.user_data.get("total"),
-        attempts=ctx.user_data.get("attempts")
+    args = (
+        display_name(q.from_user),
+        s.exam,
+        s.topic,
+        s.score,
+        s.graded,
+        await load_attempts([s.attempt(i) for i in s.review_positions("all")])
     )
+    key = pdf_content_key(*args)
+
+    # Same result already uploaded → re-send by file_id
+    file_id = pdf_file_cache.get(key)
+    if file_id:
+        try:
+            await ctx.bot.send_document(chat_id=q.from_user.id, document=file_id)
+            return
+        except BadRequest:
+            pass  # file_id no longer valid → render again
+
+    data = await pdf_renderer.render(*args)
+
+    if data is None:
+        await q.message.reply_text(
+            "⏳ PDF service is busy right now. Please try again in a minute."
+        )
+        return
 
     # Send PDF to user
-    await ctx.bot.send_document(
+    msg = await ctx.bot.send_document(
         chat_id=q.from_user.id,
-        document=open(path, "rb"),
-        filename="MCQ_Result.pdf"
+        document=InputFile(data, filename="MCQ_Result.pdf")
     )
 
-    # Cleanup
-    try:
-        os.remove(path)
-    except Exception:
-        pass
+    if msg and msg.document:
+        pdf_file_cache.put(key, msg.document.file_id)
 # =====================================================
 # PART-5 : USER PROFILE + LEADERBOARD + DONATE
 # =====================================================
@@ -729,7 +2265,7 @@ async def profile(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
 
     user = q.from_user
 
-    cur.execute("""
+    rows = await db.fetchall("""
         SELECT exam, topic, MAX(score) AS best_score, total, MAX(test_date) AS last_date
         FROM scores
         WHERE user_id=?
@@ -737,8 +2273,6 @@ async def profile(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         ORDER BY last_date DESC
     """, (user.id,))
 
-    rows = cur.fetchall()
-
     text = f"👤 *{display_name(user)}*\n\n"
 
     if not rows:
@@ -766,8 +2300,9 @@ async def leaderboard(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
 
-    exam = ctx.user_data.get("exam")
-    topic = ctx.user_data.get("topic")
+    s = ctx.user_data.get("session")
+    exam = s.exam if s else None
+    topic = s.topic if s else None
 
     if not exam or not topic:
         await safe_edit_or_send(
@@ -777,7 +2312,7 @@ async def leaderboard(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         )
         return
 
-    cur.execute("""
+    rows = await db.fetchall("""
         SELECT u.username, u.first_name, u.last_name, MAX(s.score) AS best_score
         FROM scores s
         JOIN users u ON u.user_id = s.user_id
@@ -787,8 +2322,6 @@ async def leaderboard(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         LIMIT 10
     """, (exam, topic))
 
-    rows = cur.fetchall()
-
     text = f"🏆 *Leaderboard*\n*{exam} / {topic}*\n\n"
 
     if not rows:
@@ -878,6 +2411,7 @@ async def admin_panel(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
 
             # ---- TEST CONTROL ----
             [InlineKeyboardButton("🚫 Enable / Disable Test", callback_data="admin_toggle_test")],
+            [InlineKeyboardButton("📏 Test Length", callback_data="admin_paper_length")],
             [InlineKeyboardButton("🗑 Delete Test", callback_data="admin_delete_test")],
 
             # ---- UTILITIES ----
@@ -899,51 +2433,68 @@ async def admin_stats(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     today = datetime.date.today().isoformat()
     last_7 = (datetime.date.today() - datetime.timedelta(days=7)).isoformat()
 
-    # ---- TOTAL USERS ----
-    cur.execute("SELECT COUNT(*) FROM users")
-    total_users = cur.fetchone()[0]
-
-    # ---- ACTIVE TODAY ----
-    cur.execute("""
-        SELECT COUNT(DISTINCT user_id)
-        FROM scores
-        WHERE test_date=?
-    """, (today,))
-    active_today = cur.fetchone()[0]
-
-    # ---- ACTIVE LAST 7 DAYS ----
-    cur.execute("""
-        SELECT COUNT(DISTINCT user_id)
-        FROM scores
-        WHERE test_date>=?
-    """, (last_7,))
-    active_7 = cur.fetchone()[0]
-
-    # ---- TOTAL TESTS GIVEN ----
-    cur.execute("SELECT COUNT(*) FROM scores")
-    total_tests = cur.fetchone()[0]
-
-    # ---- MOST POPULAR TEST ----
-    cur.execute("""
-        SELECT exam, topic, COUNT(*) AS c
-        FROM scores
-        GROUP BY exam, topic
-        ORDER BY c DESC
-        LIMIT 1
-    """)
-    row = cur.fetchone()
+    def collect(conn):
+        stats = {}
+
+        # ---- TOTAL USERS ----
+        stats["total_users"] = conn.execute(
+            "SELECT COUNT(*) FROM users"
+        ).fetchone()[0]
+
+        # ---- UNREACHABLE (blocked / deleted) ----
+        stats["unreachable"] = conn.execute(
+            "SELECT COUNT(*) FROM users WHERE reachable=0"
+        ).fetchone()[0]
+
+        # ---- ACTIVE TODAY ----
+        stats["active_today"] = conn.execute("""
+            SELECT COUNT(DISTINCT user_id)
+            FROM scores
+            WHERE test_date=?
+        """, (today,)).fetchone()[0]
+
+        # ---- ACTIVE LAST 7 DAYS ----
+        stats["active_7"] = conn.execute("""
+            SELECT COUNT(DISTINCT user_id)
+            FROM scores
+            WHERE test_date>=?
+        """, (last_7,)).fetchone()[0]
+
+        # ---- TOTAL TESTS GIVEN ----
+        stats["total_tests"] = conn.execute(
+            "SELECT COUNT(*) FROM scores"
+        ).fetchone()[0]
+
+        # ---- MOST POPULAR TEST ----
+        stats["popular"] = conn.execute("""
+            SELECT exam, topic, COUNT(*) AS c
+            FROM scores
+            GROUP BY exam, topic
+            ORDER BY c DESC
+            LIMIT 1
+        """).fetchone()
+
+        # ---- TEST ANALYTICS ----
+        stats["per_test"] = conn.execute("""
+            SELECT exam, topic, question_count
+            FROM tests
+        """).fetchall()
+
+        return stats
+
+    stats = await db.read(collect)
+
+    total_users = stats["total_users"]
+    unreachable = stats["unreachable"]
+    active_today = stats["active_today"]
+    active_7 = stats["active_7"]
+    total_tests = stats["total_tests"]
+
+    row = stats["popular"]
     popular = f"{row[0]} / {row[1]} ({row[2]} attempts)" if row else "N/A"
 
-    # ---- TEST ANALYTICS ----
-    cur.execute("SELECT COUNT(*) FROM mcq")
-    total_mcqs = cur.fetchone()[0]
-
-    cur.execute("""
-        SELECT exam, topic, COUNT(*) AS c
-        FROM mcq
-        GROUP BY exam, topic
-    """)
-    per_test = cur.fetchall()
+    per_test = stats["per_test"]
+    total_mcqs = sum(c for _, _, c in per_test)
 
     weak_tests = [
         f"{e} / {t} → {c} MCQs"
@@ -956,13 +2507,31 @@ async def admin_stats(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     text = (
         "📊 *Admin Analytics Dashboard*\n\n"
         f"👥 *Total Users:* {total_users}\n"
+        f"📬 *Reachable:* {total_users - unreachable} • "
+        f"🚫 *Unreachable:* {unreachable}\n"
         f"🟢 *Active Today:* {active_today}\n"
         f"📆 *Active Last 7 Days:* {active_7}\n"
         f"🧪 *Total Tests Given:* {total_tests}\n\n"
         f"🔥 *Most Popular Test:*\n{popular}\n\n"
         f"📊 *Test Analytics*\n"
         f"• Total MCQs: {total_mcqs}\n"
-        f"• Weak Tests (<10 MCQs):\n{weak_text}"
+        f"• Weak Tests (<10 MCQs):\n{weak_text}\n\n"
+        f"📄 *PDF Workers*\n"
+        f"• Busy: {pdf_renderer.running} / {pdf_renderer.workers}\n"
+        f"• Queue: {pdf_renderer.waiting} (peak {pdf_renderer.peak_waiting}, "
+        f"max {pdf_renderer.max_queue})\n"
+        f"• Rendered: {pdf_renderer.rendered} • Refused: {pdf_renderer.rejected} • "
+        f"Pool restarts: {pdf_renderer.restarts}\n"
+        f"• Re-sent by file_id: {pdf_file_cache.hits}\n\n"
+        f"📤 *Outbound Queue*\n"
+        f"• Interactive: {outbound_limiter.waiting[PRIORITY_INTERACTIVE]} • "
+        f"Documents: {outbound_limiter.waiting[PRIORITY_DOCUMENT]} • "
+        f"Bulk: {outbound_limiter.waiting[PRIORITY_BULK]}\n"
+        f"• Flood-wait retries: {outbound_limiter.retries}\n\n"
+        f"📝 *Exam Sessions*\n"
+        f"• Live: {sessions.live(ctx.application.user_data)} • Evicted: {sessions.evicted} • "
+        f"Resumed: {sessions.resumed}\n"
+        f"• Restored after restart: {sessions.restored}"
     )
 
     await safe_edit_or_send(
@@ -980,8 +2549,9 @@ async def admin_users(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
 
-    cur.execute("""
+    rows = await db.fetchall("""
         SELECT u.user_id, u.username, u.first_name, u.last_name,
+               u.reachable,
                COUNT(s.id) AS test_count,
                MAX(s.test_date) AS last_active
         FROM users u
@@ -991,14 +2561,12 @@ async def admin_users(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         LIMIT 20
     """)
 
-    rows = cur.fetchall()
-
     text = "👥 *Users (Latest 20)*\n\n"
 
     if not rows:
         text += "_No users found._"
     else:
-        for uid, username, first, last, tests, last_date in rows:
+        for uid, username, first, last, reachable, tests, last_date in rows:
             name = (
                 f"@{username}" if username
                 else f"{first or ''} {last or ''}".strip()
@@ -1007,7 +2575,9 @@ async def admin_users(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
             text += (
                 f"*{name}*\n"
                 f"• Tests: {tests or 0}\n"
-                f"• Last Active: {last_date or 'Never'}\n\n"
+                f"• Last Active: {last_date or 'Never'}\n"
+                + ("" if reachable else "• 🚫 Unreachable (blocked / deleted)\n")
+                + "\n"
             )
 
     await safe_edit_or_send(
@@ -1030,6 +2600,143 @@ REQUIRED_EXCEL_COLUMNS = [
 ]
 
 
+# ================= IMPORT PIPELINE =================
+
+IMPORT_BATCH_SIZE = 5000
+
+
+def normalize_mcq_frame(df):
+    """
+    Vectorized clean-up of an upload sheet.
+    Returns (valid rows, rejected rows with a `reason` column)
+    """
+    df = df[REQUIRED_EXCEL_COLUMNS].fillna("").astype(str)
+    for col in REQUIRED_EXCEL_COLUMNS:
+        df[col] = df[col].str.strip()
+    df["correct"] = df["correct"].str.upper()
+
+    missing = (df["exam"] == "") | (df["topic"] == "") | (df["question"] == "")
+    valid = df["correct"].isin(["A", "B", "C", "D"]) & ~missing
+
+    rejected = df[~valid].assign(
+        reason=pd.Series("correct must be A/B/C/D", index=df.index)
+        .mask(missing, "missing exam/topic/question")[~valid]
+    )
+    return df[valid], rejected
+
+
+def import_mcq_frame(conn, df, batch_size=IMPORT_BATCH_SIZE, existing=None):
+    """
+    Insert normalized rows in executemany batches (DB thread).
+    Duplicates — against the bank or within the sheet — are skipped.
+    `existing` ((exam, topic) -> set of questions) can be reused across
+    calls to stream one big file. Runs inside the caller's transaction.
+    Returns (added, duplicate rows)
+    """
+    existing = {} if existing is None else existing
+
+    # ---- EXISTING KEYS FOR THE TESTS IN THIS SHEET ----
+    pairs = list(df[["exam", "topic"]].drop_duplicates().itertuples(index=False, name=None))
+    for exam, topic in pairs:
+        if (exam, topic) not in existing:
+            existing[(exam, topic)] = {
+                question
+                for (question,) in conn.execute(
+                    "SELECT question FROM mcq WHERE exam=? AND topic=?", (exam, topic)
+                )
+            }
+
+    # ---- ONE-PASS DEDUPE ----
+    keep = []
+    for exam, topic, question in zip(df["exam"], df["topic"], df["question"]):
+        seen = existing[(exam, topic)]
+        keep.append(question not in seen)
+        seen.add(question)
+
+    rows = df.loc[keep]
+    duplicates = df.loc[[not k for k in keep]]
+
+    test_ids = {(exam, topic): ensure_test(conn, exam, topic) for exam, topic in pairs}
+    records = [
+        (*row, test_ids[(row[0], row[1])])
+        for row in rows.itertuples(index=False, name=None)
+    ]
+
+    # ---- BATCHED INSERT ----
+    for start in range(0, len(records), batch_size):
+        conn.executemany("""
+            INSERT INTO mcq
+            (exam, topic, question, a, b, c, d, correct, explanation,
+             is_active, test_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 1, ?)
+        """, records[start:start + batch_size])
+
+    recount_tests(conn, test_ids.values())
+    return len(records), duplicates
+
+
+# ================= STREAMING READERS =================
+# Sheets are read in fixed-size chunks (openpyxl read-only iterator /
+# chunked CSV), so peak memory stays flat whatever the file size.
+
+def is_xlsx(path):
+    return path.lower().endswith((".xlsx", ".xlsm"))
+
+
+def read_header(path):
+    if is_xlsx(path):
+        wb = load_workbook(path, read_only=True)
+        try:
+            first = next(wb.active.iter_rows(values_only=True), ())
+        finally:
+            wb.close()
+        return [str(h).strip() for h in first if h is not None]
+    return list(pd.read_csv(path, nrows=0, encoding="utf-8").columns)
+
+
+def iter_csv_chunks(path, size, skip=0):
+    # Resume: skip the header and `skip` records ourselves. pandas turns
+    # any skiprows (int or range) into a set of every skipped row number.
+    with open(path, encoding="utf-8-sig", newline="") as f:   # -sig: Excel BOM
+        records = csv.reader(f)
+        header = next(records, [])
+        for _ in itertools.islice(records, skip):
+            pass
+        for chunk in pd.read_csv(
+            f,
+            dtype=str,
+            keep_default_na=False,
+            chunksize=size,
+            header=None,
+            names=header,
+        ):
+            if len(chunk):      # nothing left after the skipped rows
+                yield chunk
+
+
+def iter_xlsx_chunks(path, size, skip=0):
+    wb = load_workbook(path, read_only=True)
+    try:
+        rows = wb.active.iter_rows(values_only=True)
+        header = [str(h).strip() if h is not None else "" for h in next(rows, ())]
+        rows = itertools.islice(rows, skip, None)
+        while True:
+            batch = list(itertools.islice(rows, size))
+            if not batch:
+                break
+            yield pd.DataFrame(batch, columns=header)
+    finally:
+        wb.close()
+
+
+def iter_sheet_chunks(path, size=IMPORT_BATCH_SIZE, skip=0):
+    """
+    DataFrame chunks of `size` rows, after skipping `skip` data rows
+    """
+    reader = iter_xlsx_chunks if is_xlsx(path) else iter_csv_chunks
+    return reader(path, size, skip)
+
+
 # ================= ADMIN UPLOAD ENTRY =================
 
 async def admin_upload(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
@@ -1043,7 +2750,7 @@ async def admin_upload(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     ctx.user_data["await_excel"] = True
 
     await q.message.reply_text(
-        "📤 *Upload MCQ Excel File*\n\n"
+        "📤 *Upload MCQ Excel File* (.xlsx or .csv)\n\n"
         "*Required Columns:*\n"
         "`exam, topic, question, a, b, c, d, correct, explanation`\n\n"
         "• Duplicate MCQs will be skipped\n"
@@ -1066,64 +2773,79 @@ async def handle_excel(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     doc = update.message.document
     file = await doc.get_file()
 
-    path = tempfile.mktemp(".xlsx")
+    suffix = os.path.splitext(doc.file_name or "")[1].lower()
+    path = tempfile.mktemp(suffix if suffix == ".csv" else ".xlsx")
     await file.download_to_drive(path)
 
     try:
-        df = pd.read_excel(path)
-    except Exception as e:
-        await update.message.reply_text(f"❌ Excel read error: {e}")
-        return
-
-    # ---- VALIDATE COLUMNS ----
-    missing = [c for c in REQUIRED_EXCEL_COLUMNS if c not in df.columns]
-    if missing:
-        await update.message.reply_text(
-            f"❌ Missing required columns:\n{', '.join(missing)}"
-        )
-        return
-
-    added = 0
-    skipped = 0
-    invalid = 0
-
-    # ---- PROCESS ROWS ----
-    for _, r in df.iterrows():
+        # ---- VALIDATE COLUMNS (header row only) ----
         try:
-            exam = str(r["exam"]).strip()
-            topic = str(r["topic"]).strip()
-            question = str(r["question"]).strip()
-            a = str(r["a"]).strip()
-            b = str(r["b"]).strip()
-            c = str(r["c"]).strip()
-            d = str(r["d"]).strip()
-            correct = str(r["correct"]).strip().upper()
-            explanation = str(r["explanation"]).strip()
-
-            if correct not in ("A", "B", "C", "D"):
-                invalid += 1
-                continue
+            header = await asyncio.to_thread(read_header, path)
+        except Exception as e:
+            await update.message.reply_text(f"❌ Excel read error: {e}")
+            return
+
+        missing = [c for c in REQUIRED_EXCEL_COLUMNS if c not in header]
+        if missing:
+            await update.message.reply_text(
+                f"❌ Missing required columns:\n{', '.join(missing)}"
+            )
+            return
 
-            # ---- DUPLICATE DETECTION ----
-            if is_duplicate_mcq(exam, topic, question):
-                skipped += 1
-                continue
+        status = await update.message.reply_text("⏳ Importing…")
 
-            cur.execute("""
-                INSERT INTO mcq
-                (exam, topic, question, a, b, c, d, correct, explanation, is_active)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 1)
-            """, (
-                exam, topic, question,
-                a, b, c, d,
-                correct, explanation
-            ))
-            added += 1
+        added = 0
+        skipped = 0
+        invalid = 0
+        rows = 0        # rows of committed chunks
+        error = None
+        existing = {}   # dedupe keys, shared across chunks
 
+        # ---- STREAM CHUNKS: parse → normalize → dedupe + insert ----
+        chunks = iter_sheet_chunks(path, IMPORT_BATCH_SIZE)
+        try:
+            while True:
+                # Parsing is CPU-bound: keep it off the event loop
+                chunk = await asyncio.to_thread(next, chunks, None)
+                if chunk is None:
+                    break
+
+                valid, rejected = await asyncio.to_thread(normalize_mcq_frame, chunk)
+                chunk_added, duplicates = await db.run(
+                    import_mcq_frame, valid, IMPORT_BATCH_SIZE, existing
+                )
+
+                rows += len(chunk)
+                added += chunk_added
+                skipped += len(duplicates)
+                invalid += len(rejected)
+
+                try:
+                    await status.edit_text(f"⏳ Importing… {rows} rows")
+                except BadRequest:
+                    pass
+        except Exception as e:
+            error = e
+        finally:
+            chunks.close()
+            await catalog.publish()
+    finally:
+        try:
+            os.remove(path)
         except Exception:
-            invalid += 1
+            pass
 
-    conn.commit()
+    if error is not None:
+        # Chunks before the failing one are already committed
+        await update.message.reply_text(
+            f"❌ Excel read error: {error}\n\n"
+            "⚠️ Partial Upload Summary\n"
+            f"Committed: first {rows} rows\n"
+            f"➕ Added: {added}\n"
+            f"⏭ Skipped (Duplicate): {skipped}\n"
+            f"⚠️ Invalid Rows: {invalid}"
+        )
+        return
 
     await update.message.reply_text(
         "✅ *Upload Summary*\n\n"
@@ -1144,12 +2866,13 @@ async def admin_export(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         await safe_edit_or_send(q, "⛔ Unauthorized", home_kb())
         return
 
-    cur.execute("""
-        SELECT exam, topic, question, a, b, c, d, correct, explanation, is_active
-        FROM mcq
-        ORDER BY exam, topic
+    rows = await db.fetchall("""
+        SELECT m.exam, m.topic, m.question, m.a, m.b, m.c, m.d,
+               m.correct, m.explanation, COALESCE(t.is_active, m.is_active)
+        FROM mcq m
+        LEFT JOIN tests t ON t.id = m.test_id
+        ORDER BY m.exam, m.topic
     """)
-    rows = cur.fetchall()
 
     if not rows:
         await safe_edit_or_send(q, "⚠️ No MCQs found.", home_kb())
@@ -1162,18 +2885,21 @@ async def admin_export(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     ])
 
     path = tempfile.mktemp(".xlsx")
-    df.to_excel(path, index=False)
-
-    await ctx.bot.send_document(
-        chat_id=q.from_user.id,
-        document=open(path, "rb"),
-        filename="MCQ_Database_Export.xlsx"
-    )
-
     try:
-        os.remove(path)
-    except Exception:
-        pass
+        # Writing the workbook is slow CPU work: keep it off the event loop
+        await asyncio.to_thread(df.to_excel, path, index=False)
+
+        with open(path, "rb") as f:
+            await ctx.bot.send_document(
+                chat_id=q.from_user.id,
+                document=f,
+                filename="MCQ_Database_Export.xlsx"
+            )
+    finally:
+        try:
+            os.remove(path)
+        except Exception:
+            pass
 # =====================================================
 # PART-8 : MANUAL MCQ WIZARD + SEARCH / EDIT MCQ
 # =====================================================
@@ -1317,8 +3043,8 @@ async def finalize_mcq(update_or_message, ctx: ContextTypes.DEFAULT_TYPE):
     data["correct"] = data["correct"].upper()
 
     # ---- DUPLICATE CHECK ----
-    if not wizard.get("force") and is_duplicate_mcq(
-        data["exam"], data["topic"], data["question"]
+    if not wizard.get("force") and await db.read(
+        is_duplicate_mcq, data["exam"], data["topic"], data["question"]
     ):
         ctx.user_data["pending_duplicate"] = True
         await update_or_message.reply_text(
@@ -1330,16 +3056,23 @@ async def finalize_mcq(update_or_message, ctx: ContextTypes.DEFAULT_TYPE):
         return
 
     # ---- SAVE MCQ ----
-    cur.execute("""
-        INSERT INTO mcq
-        (exam, topic, question, a, b, c, d, correct, explanation, is_active)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 1)
-    """, (
-        data["exam"], data["topic"], data["question"],
-        data["a"], data["b"], data["c"], data["d"],
-        data["correct"], data["explanation"]
-    ))
-    conn.commit()
+    def save_mcq(conn):
+        test_id = ensure_test(conn, data["exam"], data["topic"])
+        conn.execute("""
+            INSERT INTO mcq
+            (exam, topic, question, a, b, c, d, correct, explanation,
+             is_active, test_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 1, ?)
+        """, (
+            data["exam"], data["topic"], data["question"],
+            data["a"], data["b"], data["c"], data["d"],
+            data["correct"], data["explanation"],
+            test_id
+        ))
+        recount_tests(conn, [test_id])
+
+    await db.run(save_mcq)
+    await catalog.publish()
 
     # ---- CLEAN STATE ----
     ctx.user_data.pop("mcq_wizard", None)
@@ -1389,15 +3122,13 @@ async def admin_search_router(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
 
     text = update.message.text.strip()
 
-    cur.execute("""
+    rows = await db.fetchall("""
         SELECT id, question
         FROM mcq
         WHERE question LIKE ?
         LIMIT 20
     """, (f"%{text}%",))
 
-    rows = cur.fetchall()
-
     if not rows:
         await update.message.reply_text("❌ No MCQ found.")
         return
@@ -1468,8 +3199,9 @@ async def admin_edit_apply(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
 
     value = text.upper() if field == "correct" else text
 
-    cur.execute(f"UPDATE mcq SET {field}=? WHERE id=?", (value, mcq_id))
-    conn.commit()
+    await db.execute(f"UPDATE mcq SET {field}=? WHERE id=?", (value, mcq_id))
+    question_cache.invalidate([mcq_id])
+    await catalog.publish()
 
     # Cleanup
     ctx.user_data.pop("admin_mode", None)
@@ -1491,26 +3223,24 @@ async def admin_toggle_test(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         await safe_edit_or_send(q, "⛔ Unauthorized", home_kb())
         return
 
-    # Fetch distinct exam-topic with current state
-    cur.execute("""
-        SELECT exam, topic, MAX(is_active)
-        FROM mcq
-        GROUP BY exam, topic
+    # Test-level state comes straight from the tests table
+    rows = await db.fetchall("""
+        SELECT id, exam, topic, is_active
+        FROM tests
         ORDER BY exam, topic
     """)
-    rows = cur.fetchall()
 
     if not rows:
         await safe_edit_or_send(q, "⚠️ No tests found.", home_kb())
         return
 
     kb = []
-    for exam, topic, active in rows:
+    for test_id, exam, topic, active in rows:
         status = "🟢 ON" if active else "🔴 OFF"
         kb.append([
             InlineKeyboardButton(
                 f"{exam} | {topic} — {status}",
-                callback_data=f"toggle_test::{exam}::{topic}"
+                callback_data=f"toggle_test::{test_id}"
             )
         ])
 
@@ -1530,29 +3260,29 @@ async def admin_toggle_action(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     if not is_admin(q.from_user.id):
         return
 
-    _, exam, topic = q.data.split("::", 2)
+    test_id = int(q.data.split("::", 1)[1])
 
-    # Get current state
-    cur.execute("""
-        SELECT is_active
-        FROM mcq
-        WHERE exam=? AND topic=?
-        LIMIT 1
-    """, (exam, topic))
-    row = cur.fetchone()
+    def toggle(conn):
+        # Single-row flip — MCQ rows are never rewritten
+        conn.execute("""
+            UPDATE tests
+            SET is_active = 1 - is_active, updated_at = ?
+            WHERE id = ?
+        """, (datetime.datetime.utcnow().isoformat(), test_id))
+
+        return conn.execute(
+            "SELECT exam, topic, is_active FROM tests WHERE id=?", (test_id,)
+        ).fetchone()
+
+    row = await db.run(toggle)
 
     if not row:
         await q.message.reply_text("⚠️ Test not found.")
         return
 
-    new_state = 0 if row[0] == 1 else 1
+    exam, topic, new_state = row
 
-    cur.execute("""
-        UPDATE mcq
-        SET is_active=?
-        WHERE exam=? AND topic=?
-    """, (new_state, exam, topic))
-    conn.commit()
+    await catalog.publish()
 
     await q.message.reply_text(
         f"✅ Test `{exam} / {topic}` set to "
@@ -1561,9 +3291,9 @@ async def admin_toggle_action(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     )
 
 
-# ================= DELETE TEST (DANGEROUS) =================
+# ================= TEST PAPER LENGTH =================
 
-async def admin_delete_test(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+async def admin_paper_length(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
 
@@ -1571,12 +3301,11 @@ async def admin_delete_test(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         await safe_edit_or_send(q, "⛔ Unauthorized", home_kb())
         return
 
-    cur.execute("""
-        SELECT DISTINCT exam, topic
-        FROM mcq
+    rows = await db.fetchall("""
+        SELECT id, exam, topic, question_count, paper_length
+        FROM tests
         ORDER BY exam, topic
     """)
-    rows = cur.fetchall()
 
     if not rows:
         await safe_edit_or_send(q, "⚠️ No tests found.", home_kb())
@@ -1584,63 +3313,160 @@ async def admin_delete_test(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
 
     kb = [
         [InlineKeyboardButton(
-            f"{exam} | {topic}",
-            callback_data=f"delete_test::{exam}::{topic}"
+            f"{exam} | {topic} — {length or 'All'} / {count}",
+            callback_data=f"paper_len::{test_id}"
         )]
-        for exam, topic in rows
+        for test_id, exam, topic, count, length in rows
     ]
 
     kb.append([InlineKeyboardButton("⬅️ Back", callback_data="admin_panel")])
 
     await safe_edit_or_send(
         q,
-        "🗑 *DELETE TEST (Dangerous)*\nSelect exam/topic:",
+        "📏 *Test Length*\nQuestions per attempt — tap to change:",
         InlineKeyboardMarkup(kb)
     )
 
 
-async def admin_delete_confirm(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+async def admin_paper_length_select(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
 
     if not is_admin(q.from_user.id):
         return
 
-    _, exam, topic = q.data.split("::", 2)
+    ctx.user_data["admin_mode"] = "paper_length"
+    ctx.user_data["paper_length_test"] = int(q.data.split("::", 1)[1])
 
-    # Confirmation screen
-    await safe_edit_or_send(
-        q,
-        "⚠️ *CONFIRM DELETE*\n\n"
-        f"Exam: *{exam}*\n"
-        f"Topic: *{topic}*\n\n"
-        "❗ This will permanently delete:\n"
-        "• All MCQs\n"
-        "• All Scores\n\n"
-        "*This action is IRREVERSIBLE!*",
-        InlineKeyboardMarkup([
-            [InlineKeyboardButton("❌ Cancel", callback_data="admin_panel")],
-            [InlineKeyboardButton(
-                "🔥 YES, DELETE",
-                callback_data=f"delete_final::{exam}::{topic}"
-            )]
-        ])
+    await q.message.reply_text(
+        "📏 Send number of questions per attempt.\n\n"
+        "`0` = all questions, `/cancel` to abort.",
+        parse_mode="Markdown"
     )
 
 
-async def admin_delete_final(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
-    q = update.callback_query
-    await q.answer()
+async def admin_paper_length_apply(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.effective_user.id):
+        return
 
-    if not is_admin(q.from_user.id):
+    if ctx.user_data.get("admin_mode") != "paper_length":
         return
 
-    _, exam, topic = q.data.split("::", 2)
+    text = update.message.text.strip()
 
-    # Delete MCQs and scores
-    cur.execute("DELETE FROM mcq WHERE exam=? AND topic=?", (exam, topic))
-    cur.execute("DELETE FROM scores WHERE exam=? AND topic=?", (exam, topic))
-    conn.commit()
+    if text.lower() == "/cancel":
+        ctx.user_data.pop("admin_mode", None)
+        ctx.user_data.pop("paper_length_test", None)
+        await update.message.reply_text("❌ Cancelled.")
+        return
+
+    if not text.isdigit():
+        await update.message.reply_text("❌ Send a number (0 = all questions).")
+        return
+
+    length = int(text)
+    test_id = ctx.user_data.pop("paper_length_test", None)
+    ctx.user_data.pop("admin_mode", None)
+
+    await db.execute("""
+        UPDATE tests
+        SET paper_length=?, updated_at=?
+        WHERE id=?
+    """, (length or None, datetime.datetime.utcnow().isoformat(), test_id))
+    await catalog.publish()
+
+    await update.message.reply_text(
+        f"✅ Test length set to {length or 'all'} questions."
+    )
+
+
+# ================= DELETE TEST (DANGEROUS) =================
+
+async def admin_delete_test(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    await q.answer()
+
+    if not is_admin(q.from_user.id):
+        await safe_edit_or_send(q, "⛔ Unauthorized", home_kb())
+        return
+
+    rows = await db.fetchall("""
+        SELECT exam, topic
+        FROM tests
+        ORDER BY exam, topic
+    """)
+
+    if not rows:
+        await safe_edit_or_send(q, "⚠️ No tests found.", home_kb())
+        return
+
+    kb = [
+        [InlineKeyboardButton(
+            f"{exam} | {topic}",
+            callback_data=f"delete_test::{exam}::{topic}"
+        )]
+        for exam, topic in rows
+    ]
+
+    kb.append([InlineKeyboardButton("⬅️ Back", callback_data="admin_panel")])
+
+    await safe_edit_or_send(
+        q,
+        "🗑 *DELETE TEST (Dangerous)*\nSelect exam/topic:",
+        InlineKeyboardMarkup(kb)
+    )
+
+
+async def admin_delete_confirm(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    await q.answer()
+
+    if not is_admin(q.from_user.id):
+        return
+
+    _, exam, topic = q.data.split("::", 2)
+
+    # Confirmation screen
+    await safe_edit_or_send(
+        q,
+        "⚠️ *CONFIRM DELETE*\n\n"
+        f"Exam: *{exam}*\n"
+        f"Topic: *{topic}*\n\n"
+        "❗ This will permanently delete:\n"
+        "• All MCQs\n"
+        "• All Scores\n\n"
+        "*This action is IRREVERSIBLE!*",
+        InlineKeyboardMarkup([
+            [InlineKeyboardButton("❌ Cancel", callback_data="admin_panel")],
+            [InlineKeyboardButton(
+                "🔥 YES, DELETE",
+                callback_data=f"delete_final::{exam}::{topic}"
+            )]
+        ])
+    )
+
+
+async def admin_delete_final(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    await q.answer()
+
+    if not is_admin(q.from_user.id):
+        return
+
+    _, exam, topic = q.data.split("::", 2)
+
+    def delete_test(conn):
+        ids = [r[0] for r in conn.execute(
+            "SELECT id FROM mcq WHERE exam=? AND topic=?", (exam, topic)
+        )]
+        # Delete MCQs, scores and the test itself
+        conn.execute("DELETE FROM mcq WHERE exam=? AND topic=?", (exam, topic))
+        conn.execute("DELETE FROM scores WHERE exam=? AND topic=?", (exam, topic))
+        conn.execute("DELETE FROM tests WHERE exam=? AND topic=?", (exam, topic))
+        return ids
+
+    question_cache.invalidate(await db.run(delete_test))
+    await catalog.publish()
 
     await q.message.reply_text(
         f"✅ Test `{exam} / {topic}` deleted permanently.",
@@ -1652,6 +3478,73 @@ async def admin_delete_final(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
 
 # ================= BROADCAST =================
 
+# Segments: (kind, arg) → indexed query over reachable users
+#   all                  every user
+#   active::<days>       users.last_active (idx_users_last_active)
+#   exam::<exam>         user_exams primary key
+#   weak::<test_id>      scores(exam, topic, user_id, score, total) index
+#   joined::<date>       users.created_at (idx_users_created)
+
+WEAK_SCORE_PCT = 40
+
+
+def segment_query(kind, arg=None):
+    """
+    (sql, params) selecting the reachable user_ids of a segment
+    """
+    if kind == "active":
+        since = datetime.date.today() - datetime.timedelta(days=int(arg))
+        return ("""
+            SELECT user_id FROM users
+            WHERE last_active>=? AND reachable=1
+        """, (since.isoformat(),))
+
+    if kind == "exam":
+        return ("""
+            SELECT e.user_id FROM user_exams e
+            JOIN users u ON u.user_id=e.user_id
+            WHERE e.exam=? AND u.reachable=1
+        """, (arg,))
+
+    if kind == "weak":
+        return ("""
+            SELECT DISTINCT s.user_id FROM tests t
+            JOIN scores s ON s.exam=t.exam AND s.topic=t.topic
+            JOIN users u ON u.user_id=s.user_id
+            WHERE t.id=? AND s.score * 100 < s.total * ?
+              AND u.reachable=1
+        """, (int(arg), WEAK_SCORE_PCT))
+
+    if kind == "joined":
+        return ("""
+            SELECT user_id FROM users
+            WHERE created_at>? AND reachable=1
+        """, (arg,))
+
+    return "SELECT user_id FROM users WHERE reachable=1", ()
+
+
+def segment_size(conn, kind, arg=None):
+    sql, params = segment_query(kind, arg)
+    return conn.execute(f"SELECT COUNT(*) FROM ({sql})", params).fetchone()[0]
+
+
+def broadcast_segment_kb():
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("👥 All Users", callback_data="bseg::all")],
+        [
+            InlineKeyboardButton("🟢 Active 7 Days", callback_data="bseg::active::7"),
+            InlineKeyboardButton("📆 Active 30 Days", callback_data="bseg::active::30")
+        ],
+        [InlineKeyboardButton("📝 Attempted Exam…", callback_data="bseg_pick::exam")],
+        [InlineKeyboardButton(
+            f"📉 Scored < {WEAK_SCORE_PCT}% on Topic…", callback_data="bseg_pick::weak"
+        )],
+        [InlineKeyboardButton("🆕 Joined After Date…", callback_data="bseg_pick::joined")],
+        [InlineKeyboardButton("⬅️ Back", callback_data="admin_panel")]
+    ])
+
+
 async def admin_broadcast(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
@@ -1660,21 +3553,143 @@ async def admin_broadcast(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         await safe_edit_or_send(q, "⛔ Unauthorized", home_kb())
         return
 
+    ctx.user_data.pop("admin_mode", None)
+    ctx.user_data.pop("broadcast_segment", None)
+    ctx.user_data.pop("broadcast_text", None)
+
+    await safe_edit_or_send(
+        q,
+        "📢 *Broadcast*\n\nWho should receive it?",
+        broadcast_segment_kb()
+    )
+
+
+def exam_key(exam):
+    """
+    Short callback key for an exam: the id of one of its tests
+    """
+    return min(catalog.test_id(exam, topic) for topic in catalog.exams[exam])
+
+
+async def broadcast_segment_pick(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    """
+    Second-level menus: exam list, exam → topic list, joined-date prompt
+    """
+    q = update.callback_query
+    await q.answer()
+
+    if not is_admin(q.from_user.id):
+        return
+
+    parts = q.data.split("::")
+    back = [InlineKeyboardButton("⬅️ Back", callback_data="admin_broadcast")]
+
+    if parts[1] == "joined":
+        ctx.user_data["admin_mode"] = "broadcast_joined"
+        await safe_edit_or_send(
+            q,
+            "🆕 *Joined After Date*\n\n"
+            "Send a date as `YYYY-MM-DD`.\n\n"
+            "❌ Send `/cancel` to abort.",
+            InlineKeyboardMarkup([back])
+        )
+        return
+
+    # Exams are passed as one of their test ids: callback data is capped
+    # at 64 bytes, too short for long (Devanagari) exam names
+    if parts[1] == "exam":
+        rows = [
+            [InlineKeyboardButton(exam, callback_data=f"bseg::exam::{exam_key(exam)}")]
+            for exam in sorted(catalog.exams)
+        ]
+        title = "📝 *Attempted Exam*"
+
+    elif len(parts) == 2:
+        rows = [
+            [InlineKeyboardButton(exam, callback_data=f"bseg_pick::weak::{exam_key(exam)}")]
+            for exam in sorted(catalog.exams)
+        ]
+        title = f"📉 *Scored < {WEAK_SCORE_PCT}%* — select exam"
+
+    else:
+        row = await db.fetchone("SELECT exam FROM tests WHERE id=?", (int(parts[2]),))
+        exam = row[0] if row else ""
+        rows = [
+            [InlineKeyboardButton(
+                topic,
+                callback_data=f"bseg::weak::{catalog.test_id(exam, topic)}"
+            )]
+            for topic in sorted(catalog.exams.get(exam, {}))
+        ]
+        title = f"📉 *Scored < {WEAK_SCORE_PCT}%* — `{exam}`: select topic"
+
+    if not rows:
+        title += "\n\n_No tests found._"
+
+    await safe_edit_or_send(q, title, InlineKeyboardMarkup(rows + [back]))
+
+
+async def choose_broadcast_segment(ctx, kind, arg, label):
+    """
+    Resolve the segment size and wait for the message text
+    """
+    size = await db.read(segment_size, kind, arg)
+
+    ctx.user_data["broadcast_segment"] = (kind, arg, label)
     ctx.user_data["admin_mode"] = "broadcast"
 
-    await q.message.reply_text(
-        "📢 *Broadcast Mode*\n\n"
-        "Send the message you want to broadcast to all users.\n\n"
-        "❌ Send `/cancel` to abort.",
-        parse_mode="Markdown"
+    return (
+        f"📢 *Broadcast Mode*\n\n"
+        f"🎯 Segment: *{label}*\n"
+        f"👥 Recipients: *{size}*\n\n"
+        "Send the message you want to broadcast.\n\n"
+        "❌ Send `/cancel` to abort."
     )
 
 
+async def broadcast_segment(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    await q.answer()
+
+    if not is_admin(q.from_user.id):
+        return
+
+    parts = q.data.split("::", 2)
+    kind = parts[1]
+    arg = parts[2] if len(parts) > 2 else None
+
+    if kind == "active":
+        label = f"Active in last {arg} days"
+    elif kind == "exam":
+        row = await db.fetchone(
+            "SELECT exam FROM tests WHERE id=?", (int(arg),)
+        )
+        if not row:
+            await safe_edit_or_send(q, "⚠️ Exam not found.", broadcast_segment_kb())
+            return
+        arg = row[0]
+        label = f"Attempted {arg}"
+    elif kind == "weak":
+        row = await db.fetchone(
+            "SELECT exam, topic FROM tests WHERE id=?", (int(arg),)
+        )
+        if not row:
+            await safe_edit_or_send(q, "⚠️ Test not found.", broadcast_segment_kb())
+            return
+        label = f"Scored < {WEAK_SCORE_PCT}% on {row[0]} / {row[1]}"
+    else:
+        kind, arg, label = "all", None, "All users"
+
+    text = await choose_broadcast_segment(ctx, kind, arg, label)
+    await safe_edit_or_send(q, text)
+
+
 async def broadcast_text_router(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     if not is_admin(update.effective_user.id):
         return
 
-    if ctx.user_data.get("admin_mode") != "broadcast":
+    mode = ctx.user_data.get("admin_mode")
+    if mode not in ("broadcast", "broadcast_joined"):
         return
 
     text = update.message.text
@@ -1682,32 +3697,294 @@ async def broadcast_text_router(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     # Cancel broadcast
     if text.lower() == "/cancel":
         ctx.user_data.pop("admin_mode", None)
+        ctx.user_data.pop("broadcast_segment", None)
         await update.message.reply_text("❌ Broadcast cancelled.")
         return
 
-    cur.execute("SELECT user_id FROM users")
-    users = cur.fetchall()
-
-    success = 0
-    failed = 0
-
-    for (uid,) in users:
+    if mode == "broadcast_joined":
         try:
-            await ctx.bot.send_message(uid, text)
-            success += 1
-        except Exception:
-            failed += 1
+            since = datetime.date.fromisoformat(text.strip()).isoformat()
+        except ValueError:
+            await update.message.reply_text("❌ Send a date like `2024-01-31`", parse_mode="Markdown")
+            return
+
+        reply = await choose_broadcast_segment(
+            ctx, "joined", since, f"Joined after {since}"
+        )
+        await update.message.reply_text(reply, parse_mode="Markdown")
+        return
 
     ctx.user_data.pop("admin_mode", None)
+    ctx.user_data["broadcast_text"] = text
+    kind, arg, label = ctx.user_data.get("broadcast_segment") or ("all", None, "All users")
+
+    size = await db.read(segment_size, kind, arg)
 
     await update.message.reply_text(
-        "✅ *Broadcast Complete*\n\n"
-        f"📨 Sent: {success}\n"
-        f"❌ Failed: {failed}",
-        parse_mode="Markdown"
+        f"📢 *Confirm Broadcast*\n\n"
+        f"🎯 Segment: *{label}*\n"
+        f"👥 Recipients: *{size}*",
+        parse_mode="Markdown",
+        reply_markup=InlineKeyboardMarkup([
+            [InlineKeyboardButton(f"✅ Send to {size} users", callback_data="broadcast_confirm")],
+            [InlineKeyboardButton("❌ Cancel", callback_data="admin_broadcast")]
+        ])
+    )
+
+
+async def broadcast_confirm(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    await q.answer()
+
+    if not is_admin(q.from_user.id):
+        return
+
+    text = ctx.user_data.pop("broadcast_text", None)
+    segment = ctx.user_data.pop("broadcast_segment", None) or ("all", None, "All users")
+
+    if not text:
+        await safe_edit_or_send(q, "⚠️ *Session expired.*", broadcast_segment_kb())
+        return
+
+    kind, arg, label = segment
+    sql, params = segment_query(kind, arg)
+
+    status = await q.message.reply_text("📢 Broadcast queued…")
+
+    def create(conn):
+        cur = conn.execute("""
+            INSERT INTO broadcasts
+            (text, segment, admin_chat, status_msg, created_at)
+            VALUES (?, ?, ?, ?, ?)
+        """, (
+            text, label, status.chat_id, status.message_id,
+            datetime.datetime.now().isoformat(timespec="seconds")
+        ))
+        broadcast_id = cur.lastrowid
+
+        # Recipients fixed now; the job walks this list by user_id
+        total = conn.execute(f"""
+            INSERT OR IGNORE INTO broadcast_recipients (broadcast_id, user_id)
+            SELECT ?, user_id FROM ({sql})
+        """, (broadcast_id, *params)).rowcount
+        conn.execute(
+            "UPDATE broadcasts SET total=? WHERE id=?", (total, broadcast_id)
+        )
+        return broadcast_id
+
+    broadcast_id = await db.run(create)
+    schedule_broadcast(ctx.job_queue, broadcast_id)
+
+
+async def broadcast_stop(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+
+    if not is_admin(q.from_user.id):
+        await q.answer()
+        return
+
+    broadcast_id = int(q.data.split("::")[1])
+
+    # Seen by the job at its next batch, in whichever process runs it
+    await db.execute(
+        "UPDATE broadcasts SET status='stopping' WHERE id=? AND status='running'",
+        (broadcast_id,)
+    )
+    await q.answer("🛑 Stopping…")
+
+
+# ================= BROADCAST ENGINE =================
+# Jobs live in the `broadcasts` table and run on the JobQueue.
+# Recipients (broadcast_recipients, resolved from the segment when the
+# job is created) are walked in user_id order in batches; the cursor is
+# committed after every batch, so a restart resumes where it stopped
+# (at most one batch may be delivered twice).
+
+# Sending speed and RetryAfter are handled by PriorityRateLimiter (PART-1):
+# broadcast messages go out as PRIORITY_BULK, capped at BROADCAST_RATE.
+
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY") or 8)
+BROADCAST_BATCH = int(os.getenv("BROADCAST_BATCH") or 200)
+BROADCAST_PROGRESS_EVERY = 5                                      # seconds
+
+
+SEND_OK = "sent"
+SEND_FAILED = "failed"
+SEND_UNREACHABLE = "unreachable"
+
+# BadRequest texts that mean the chat is gone for good
+UNREACHABLE_ERRORS = ("chat not found", "user is deactivated", "peer_id_invalid")
+
+
+async def broadcast_send(bot, user_id, text) -> str:
+    """
+    Deliver one message at bulk priority; returns a SEND_* outcome
+    """
+    try:
+        await bot.send_message(user_id, text, rate_limit_args=PRIORITY_BULK)
+        return SEND_OK
+    except Forbidden:
+        return SEND_UNREACHABLE
+    except BadRequest as e:
+        if any(m in str(e).lower() for m in UNREACHABLE_ERRORS):
+            return SEND_UNREACHABLE
+        return SEND_FAILED
+    except TelegramError:
+        return SEND_FAILED
+
+
+def broadcast_progress_text(b, rate, state, segment=None):
+    done = b["sent"] + b["failed"] + b["unreachable"]
+    pct = done * 100 // b["total"] if b["total"] else 100
+    head = {
+        "running": "📢 *Broadcast Running*",
+        "done": "✅ *Broadcast Complete*",
+        "cancelled": "🛑 *Broadcast Stopped*",
+    }[state]
+    return (
+        f"{head}\n\n"
+        + (f"🎯 Segment: {segment}\n" if segment else "")
+        + f"📊 Progress: {done} / {b['total']} ({pct}%)\n"
+        f"📨 Sent: {b['sent']}\n"
+        f"❌ Failed: {b['failed']}\n"
+        f"🚫 Unreachable: {b['unreachable']}\n"
+        f"⚡ Speed: {rate:.1f} msg/s"
+    )
+
+
+async def broadcast_job(ctx: ContextTypes.DEFAULT_TYPE):
+    broadcast_id = ctx.job.data
+
+    row = await db.fetchone("""
+        SELECT text, segment, cursor, total, sent, failed, unreachable,
+               admin_chat, status_msg
+        FROM broadcasts WHERE id=? AND status='running'
+    """, (broadcast_id,))
+    if not row:
+        return
+
+    (text, segment, cursor, total, sent, failed, unreachable,
+     admin_chat, status_msg) = row
+    b = {
+        SEND_OK: sent, SEND_FAILED: failed, SEND_UNREACHABLE: unreachable,
+        "total": total
+    }
+
+    started = time.monotonic()
+    done_here = 0
+    last_report = 0.0
+
+    async def report(state):
+        rate = done_here / max(time.monotonic() - started, 1e-9)
+        kb = None
+        if state == "running":
+            kb = InlineKeyboardMarkup([[InlineKeyboardButton(
+                "🛑 Stop", callback_data=f"broadcast_stop::{broadcast_id}"
+            )]])
+        try:
+            await ctx.bot.edit_message_text(
+                broadcast_progress_text(b, rate, state, segment),
+                chat_id=admin_chat,
+                message_id=status_msg,
+                reply_markup=kb,
+                parse_mode="Markdown"
+            )
+        except TelegramError:
+            pass
+
+    def save_batch(conn, new_cursor, outcomes):
+        now = datetime.datetime.now().isoformat(timespec="seconds")
+        delivered = [(now, uid) for uid, r in outcomes if r == SEND_OK]
+        gone = [(now, uid) for uid, r in outcomes if r == SEND_UNREACHABLE]
+
+        conn.executemany(
+            "UPDATE users SET last_delivered=? WHERE user_id=?", delivered
+        )
+        conn.executemany(
+            "UPDATE users SET reachable=0, unreachable_at=? WHERE user_id=?", gone
+        )
+        conn.execute("""
+            UPDATE broadcasts
+            SET cursor=?, sent=sent+?, unreachable=unreachable+?,
+                failed=failed+?
+            WHERE id=?
+        """, (
+            new_cursor, len(delivered), len(gone),
+            len(outcomes) - len(delivered) - len(gone), broadcast_id
+        ))
+
+    await report("running")
+
+    state = "done"
+    while True:
+        status = await db.fetchone(
+            "SELECT status FROM broadcasts WHERE id=?", (broadcast_id,)
+        )
+        if not status or status[0] != "running":
+            state = "cancelled"
+            break
+
+        batch = [uid for (uid,) in await db.fetchall("""
+            SELECT r.user_id FROM broadcast_recipients r
+            JOIN users u ON u.user_id=r.user_id
+            WHERE r.broadcast_id=? AND r.user_id>? AND u.reachable=1
+            ORDER BY r.user_id LIMIT ?
+        """, (broadcast_id, cursor, BROADCAST_BATCH))]
+        if not batch:
+            break
+
+        recipients = iter(batch)
+        outcomes = []
+
+        async def worker():
+            for uid in recipients:
+                outcomes.append((uid, await broadcast_send(ctx.bot, uid, text)))
+
+        await asyncio.gather(*(worker() for _ in range(BROADCAST_CONCURRENCY)))
+
+        cursor = batch[-1]
+        await db.run(save_batch, cursor, outcomes)
+
+        for _, r in outcomes:
+            b[r] += 1
+        done_here += len(outcomes)
+
+        if time.monotonic() - last_report >= BROADCAST_PROGRESS_EVERY:
+            last_report = time.monotonic()
+            await report("running")
+
+    def finish(conn):
+        conn.execute("""
+            UPDATE broadcasts SET status=?, finished_at=? WHERE id=?
+        """, (state, datetime.datetime.now().isoformat(timespec="seconds"), broadcast_id))
+        conn.execute(
+            "DELETE FROM broadcast_recipients WHERE broadcast_id=?", (broadcast_id,)
+        )
+
+    await db.run(finish)
+    await report(state)
+
+
+def schedule_broadcast(job_queue, broadcast_id):
+    job_queue.run_once(
+        broadcast_job, 0,
+        data=broadcast_id,
+        name=f"broadcast-{broadcast_id}"
     )
 
 
+async def resume_broadcasts(app):
+    """
+    Re-schedule broadcasts interrupted by a restart
+    """
+    await db.execute("UPDATE broadcasts SET status='cancelled' WHERE status='stopping'")
+
+    rows = await db.fetchall("SELECT id FROM broadcasts WHERE status='running'")
+    for (broadcast_id,) in rows:
+        schedule_broadcast(app.job_queue, broadcast_id)
+    return len(rows)
+
+
 # ================= BACKUP DATABASE =================
 
 async def admin_backup(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
@@ -1718,11 +3995,30 @@ async def admin_backup(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         await safe_edit_or_send(q, "⛔ Unauthorized", home_kb())
         return
 
-    await ctx.bot.send_document(
-        chat_id=q.from_user.id,
-        document=open("mcq.db", "rb"),
-        filename="mcq_backup.db"
-    )
+    # WAL mode: the main file alone is not a consistent snapshot,
+    # so copy through SQLite's online backup API
+    path = tempfile.mktemp(".db")
+
+    def snapshot(conn):
+        target = sqlite3.connect(path)
+        try:
+            conn.backup(target)
+        finally:
+            target.close()
+
+    await db.read(snapshot)
+
+    with open(path, "rb") as f:
+        await ctx.bot.send_document(
+            chat_id=q.from_user.id,
+            document=f,
+            filename="mcq_backup.db"
+        )
+
+    try:
+        os.remove(path)
+    except Exception:
+        pass
 
 
 # ================= RESTORE DATABASE =================
@@ -1734,6 +4030,10 @@ async def admin_restore(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     if not is_admin(q.from_user.id):
         return
 
+    if WORKER_INDEX is not None:
+        await q.message.reply_text(RESTORE_MULTI_PROCESS_TEXT, parse_mode="Markdown")
+        return
+
     ctx.user_data["admin_mode"] = "restore"
 
     await q.message.reply_text(
@@ -1745,6 +4045,15 @@ async def admin_restore(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     )
 
 
+# Other worker processes keep connections to the old file: swapping it
+# under them would lose their writes and could corrupt the WAL
+RESTORE_MULTI_PROCESS_TEXT = (
+    "⛔ *Restore is disabled in multi-process mode* (BOT_WORKERS > 1).\n\n"
+    "Stop the bot, copy the `.db` file to the database path, "
+    "then start it again."
+)
+
+
 async def handle_restore(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     if not is_admin(update.effective_user.id):
         return
@@ -1752,6 +4061,11 @@ async def handle_restore(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     if ctx.user_data.get("admin_mode") != "restore":
         return
 
+    if WORKER_INDEX is not None:
+        ctx.user_data.pop("admin_mode", None)
+        await update.message.reply_text(RESTORE_MULTI_PROCESS_TEXT, parse_mode="Markdown")
+        return
+
     doc = update.message.document
 
     if not doc.file_name.endswith(".db"):
@@ -1763,8 +4077,16 @@ async def handle_restore(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     await file.download_to_drive(path)
 
     try:
-        conn.close()
-        os.replace(path, "mcq.db")
+        await db.close()
+        # Drop stale WAL / shared-memory files of the old database
+        for suffix in ("-wal", "-shm"):
+            if os.path.exists(DB_PATH + suffix):
+                os.remove(DB_PATH + suffix)
+        os.replace(path, DB_PATH)
+        # Older backups may predate the current schema
+        await db.run(migrate)
+        question_cache.invalidate()
+        await catalog.publish()
     except Exception as e:
         await update.message.reply_text(f"❌ Restore failed: {e}")
         return
@@ -1780,8 +4102,54 @@ async def handle_restore(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
 # PART-11 : HANDLERS REGISTRATION + MAIN RUNNER
 # =====================================================
 
-def main():
-    app = ApplicationBuilder().token(TOKEN).build()
+async def on_shutdown(app):
+    await sessions.flush()
+    pdf_renderer.shutdown()
+
+
+CATALOG_SYNC_SECONDS = 3
+
+WORKER_INDEX = None     # set in worker processes (multi-process mode)
+
+
+async def catalog_sync_job(ctx: ContextTypes.DEFAULT_TYPE):
+    await catalog.sync()
+
+
+async def on_startup(app):
+    version = await db.run(migrate)
+    print(f"🗄 Database schema v{version}")
+
+    await catalog.refresh()
+
+    # Pick up bank edits made by other processes (workers, upload_mcq.py)
+    app.job_queue.run_repeating(catalog_sync_job, CATALOG_SYNC_SECONDS)
+
+    # Write-behind exam sessions (restored lazily, per user)
+    app.job_queue.run_repeating(session_flush_job, SESSION_FLUSH_SECONDS)
+    app.job_queue.run_repeating(session_sweep_job, SESSION_SWEEP_SECONDS)
+
+    # Broadcast jobs belong to one process only
+    if WORKER_INDEX in (None, 0):
+        resumed = await resume_broadcasts(app)
+        if resumed:
+            print(f"📢 Resuming {resumed} broadcast(s)")
+
+
+def build_application():
+    app = (
+        ApplicationBuilder()
+        .token(TOKEN)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .rate_limiter(outbound_limiter)
+        .concurrent_updates(update_processor)
+        .build()
+    )
+
+    # ================= SESSION PERSISTENCE =================
+    app.add_handler(TypeHandler(Update, session_restore), group=-1)
+    app.add_handler(TypeHandler(Update, session_autosave), group=99)
 
     # ================= USER COMMANDS =================
     app.add_handler(CommandHandler("start", start))
@@ -1800,6 +4168,7 @@ def main():
     # ================= REVIEW SYSTEM =================
     app.add_handler(CallbackQueryHandler(review_all, "^review_all$"))
     app.add_handler(CallbackQueryHandler(review_wrong, "^review_wrong$"))
+    app.add_handler(CallbackQueryHandler(review_skipped, "^review_skipped$"))
     app.add_handler(CallbackQueryHandler(review_next, "^review_next$"))
     app.add_handler(CallbackQueryHandler(review_prev, "^review_prev$"))
     app.add_handler(CallbackQueryHandler(back_result, "^back_result$"))
@@ -1835,36 +4204,329 @@ def main():
     # ================= ENABLE / DISABLE & DELETE TEST =================
     app.add_handler(CallbackQueryHandler(admin_toggle_test, "^admin_toggle_test$"))
     app.add_handler(CallbackQueryHandler(admin_toggle_action, "^toggle_test::"))
+    app.add_handler(CallbackQueryHandler(admin_paper_length, "^admin_paper_length$"))
+    app.add_handler(CallbackQueryHandler(admin_paper_length_select, "^paper_len::"))
     app.add_handler(CallbackQueryHandler(admin_delete_test, "^admin_delete_test$"))
     app.add_handler(CallbackQueryHandler(admin_delete_confirm, "^delete_test::"))
     app.add_handler(CallbackQueryHandler(admin_delete_final, "^delete_final::"))
 
     # ================= BROADCAST / BACKUP / RESTORE =================
     app.add_handler(CallbackQueryHandler(admin_broadcast, "^admin_broadcast$"))
+    app.add_handler(CallbackQueryHandler(broadcast_stop, "^broadcast_stop::"))
+    app.add_handler(CallbackQueryHandler(broadcast_segment, "^bseg::"))
+    app.add_handler(CallbackQueryHandler(broadcast_segment_pick, "^bseg_pick::"))
+    app.add_handler(CallbackQueryHandler(broadcast_confirm, "^broadcast_confirm$"))
     app.add_handler(CallbackQueryHandler(admin_backup, "^admin_backup$"))
     app.add_handler(CallbackQueryHandler(admin_restore, "^admin_restore$"))
 
     # ================= TEXT ROUTERS (ADMIN) =================
+    # Only the first matching handler of a group runs, and every router
+    # checks its own mode — so each one gets its own group.
+    app.add_handler(
+        MessageHandler(filters.TEXT & filters.User(ADMIN_IDS), admin_text_router),
+        group=1
+    )
+    app.add_handler(
+        MessageHandler(filters.TEXT & filters.User(ADMIN_IDS), admin_search_router),
+        group=2
+    )
     app.add_handler(
-        MessageHandler(filters.TEXT & filters.User(ADMIN_IDS), admin_text_router)
+        MessageHandler(filters.TEXT & filters.User(ADMIN_IDS), broadcast_text_router),
+        group=3
     )
     app.add_handler(
-        MessageHandler(filters.TEXT & filters.User(ADMIN_IDS), admin_search_router)
+        MessageHandler(filters.TEXT & filters.User(ADMIN_IDS), admin_edit_apply),
+        group=4
     )
     app.add_handler(
-        MessageHandler(filters.TEXT & filters.User(ADMIN_IDS), broadcast_text_router)
+        MessageHandler(filters.TEXT & filters.User(ADMIN_IDS), admin_paper_length_apply),
+        group=5
     )
 
     # ================= FILE HANDLERS (ADMIN) =================
     app.add_handler(
-        MessageHandler(filters.Document.ALL & filters.User(ADMIN_IDS), handle_excel)
+        MessageHandler(filters.Document.ALL & filters.User(ADMIN_IDS), handle_excel),
+        group=1
     )
     app.add_handler(
-        MessageHandler(filters.Document.ALL & filters.User(ADMIN_IDS), handle_restore)
+        MessageHandler(filters.Document.ALL & filters.User(ADMIN_IDS), handle_restore),
+        group=2
     )
 
+    return app
+
+
+# ================= WEBHOOK SERVER =================
+# POST WEBHOOK_PATH   Telegram updates (X-Telegram-Bot-Api-Secret-Token)
+# GET  /healthz       liveness + queue depth
+
+class TelegramWebhookHandler(tornado.web.RequestHandler):
+    def initialize(self, deliver, secret):
+        self.deliver = deliver
+        self.secret = secret
+
+    async def post(self):
+        token = self.request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        # bytes: compare_digest rejects non-ASCII str with TypeError
+        if not hmac.compare_digest(token.encode(), self.secret.encode()):
+            self.set_status(403)
+            return
+
+        try:
+            data = json.loads(self.request.body)
+        except ValueError:
+            self.set_status(400)
+            return
+        if not isinstance(data, dict):
+            self.set_status(400)
+            return
+
+        # Handled asynchronously; Telegram only needs the 200
+        await self.deliver(data)
+        self.set_status(200)
+
+
+class HealthHandler(tornado.web.RequestHandler):
+    def initialize(self, status):
+        self.status = status
+
+    def get(self):
+        ok, info = self.status()
+        self.set_status(200 if ok else 503)
+        self.write(info)
+
+
+def make_webhook_app(deliver, status, path=WEBHOOK_PATH, secret=WEBHOOK_SECRET):
+    return tornado.web.Application([
+        (path, TelegramWebhookHandler, {"deliver": deliver, "secret": secret}),
+        ("/healthz", HealthHandler, {"status": status}),
+    ])
+
+
+async def register_webhook(bot):
+    if WEBHOOK_URL:
+        await bot.set_webhook(
+            WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=Update.ALL_TYPES
+        )
+
+
+def stop_event(signals=(signal.SIGINT, signal.SIGTERM)):
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in signals:
+        loop.add_signal_handler(sig, stop.set)
+    return stop
+
+
+@contextlib.asynccontextmanager
+async def running(app):
+    """
+    Same lifecycle as run_polling (post_init / post_shutdown included),
+    without the getUpdates loop
+    """
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    await app.start()
+    try:
+        yield app
+    finally:
+        await app.stop()
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+
+
+async def serve_webhook(app):
+    """
+    Single process: updates go straight onto the application's queue
+    """
+    started = time.monotonic()
+
+    async def deliver(data):
+        await app.update_queue.put(Update.de_json(data, app.bot))
+
+    def status():
+        return app.running, {
+            "status": "ok" if app.running else "starting",
+            "mode": "webhook",
+            "pending_updates": app.update_queue.qsize(),
+            "uptime": int(time.monotonic() - started)
+        }
+
+    stop = stop_event()
+    async with running(app):
+        server = tornado.httpserver.HTTPServer(
+            make_webhook_app(deliver, status), xheaders=True, max_body_size=1 << 20
+        )
+        server.listen(WEBHOOK_PORT, WEBHOOK_LISTEN)
+        await register_webhook(app.bot)
+        print(f"🌐 Webhook listening on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+
+        try:
+            await stop.wait()
+        finally:
+            server.stop()
+
+
+# ================= MULTI-PROCESS MODE =================
+# BOT_MODE=webhook + BOT_WORKERS=N:
+#   dispatcher  HTTP server only; routes each update to worker
+#               user_id % N, so a user's session lives in one process
+#   workers     full bot (handlers, caches, PDF pool) fed from a queue
+# Writes share the SQLite file (WAL + busy_timeout serialize writers);
+# bank edits reach the other workers through meta.catalog_version.
+# OUTBOUND_RATE / BROADCAST_RATE are per bot: each worker gets 1/N of
+# both, so N workers together stay within Telegram's limit.
+
+def update_user_id(data):
+    """
+    Sender id from raw update JSON (0 when there is none)
+    """
+    for value in data.values():
+        if isinstance(value, dict):
+            user = value.get("from") or value.get("user")
+            if isinstance(user, dict) and "id" in user:
+                return user["id"]
+            chat = value.get("chat")
+            if isinstance(chat, dict) and "id" in chat:
+                return chat["id"]
+    return 0
+
+
+async def serve_worker(app, updates):
+    stop = stop_event()
+    loop = asyncio.get_running_loop()
+
+    def pump():
+        # Blocking queue reads on a thread; None = dispatcher shutdown
+        while not stop.is_set():
+            try:
+                data = updates.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if data is None:
+                loop.call_soon_threadsafe(stop.set)
+                return
+            asyncio.run_coroutine_threadsafe(
+                app.update_queue.put(Update.de_json(data, app.bot)), loop
+            ).result()
+
+    async with running(app):
+        reader = asyncio.create_task(asyncio.to_thread(pump))
+        await stop.wait()
+        await reader
+
+
+def run_worker(index, updates, workers=BOT_WORKERS):
+    """
+    Worker process entry point
+    """
+    global WORKER_INDEX, outbound_limiter
+    WORKER_INDEX = index
+    outbound_limiter = PriorityRateLimiter(
+        rate=OUTBOUND_RATE / workers,
+        bulk_rate=BROADCAST_RATE / workers
+    )
+
+    asyncio.run(serve_worker(build_application(), updates))
+
+
+async def serve_dispatcher(workers=BOT_WORKERS):
+    # Schema once, before any worker opens the database
+    conn = open_connection(DB_PATH)
+    try:
+        version = migrate(conn)
+    finally:
+        conn.close()
+    print(f"🗄 Database schema v{version}")
+
+    mp = multiprocessing.get_context("spawn")
+    queues = [mp.Queue() for _ in range(workers)]
+    procs = [None] * workers
+    routed = [0] * workers
+    started = time.monotonic()
+
+    def spawn(i):
+        procs[i] = mp.Process(
+            target=run_worker, args=(i, queues[i], workers), name=f"mcq-worker-{i}"
+        )
+        procs[i].start()
+
+    async def deliver(data):
+        shard = update_user_id(data) % workers
+        routed[shard] += 1
+        queues[shard].put(data)
+
+    def status():
+        alive = sum(bool(p and p.is_alive()) for p in procs)
+        return alive == workers, {
+            "status": "ok" if alive == workers else "degraded",
+            "mode": "dispatcher",
+            "workers": workers,
+            "alive": alive,
+            "routed": routed,
+            "uptime": int(time.monotonic() - started)
+        }
+
+    stop = stop_event()
+    server = tornado.httpserver.HTTPServer(
+        make_webhook_app(deliver, status), xheaders=True, max_body_size=1 << 20
+    )
+    server.listen(WEBHOOK_PORT, WEBHOOK_LISTEN)
+
+    try:
+        if WEBHOOK_URL:
+            async with Bot(TOKEN) as bot:
+                await register_webhook(bot)
+
+        # Updates arriving before a worker is up simply wait in its queue
+        for i in range(workers):
+            spawn(i)
+
+        print(
+            f"🌐 Dispatcher listening on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}{WEBHOOK_PATH} "
+            f"→ {workers} workers"
+        )
+
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), 1)
+            except asyncio.TimeoutError:
+                pass
+            # Crashed worker → restart it on the same queue
+            for i, p in enumerate(procs):
+                if not p.is_alive() and not stop.is_set():
+                    print(f"⚠️ Worker {i} exited ({p.exitcode}), restarting")
+                    spawn(i)
+    finally:
+        server.stop()
+        for q in queues:
+            q.put(None)
+        for p in procs:
+            if p is None:
+                continue
+            p.join(15)
+            if p.is_alive():
+                p.terminate()
+
+
+def main():
+    if BOT_MODE == "webhook" and BOT_WORKERS > 1:
+        print(f"🤖 MCQ EXAM BOT — PRODUCTION RUNNING ({BOT_WORKERS} workers)...")
+        asyncio.run(serve_dispatcher())
+        return
+
+    app = build_application()
+
     print("🤖 MCQ EXAM BOT — PRODUCTION RUNNING...")
-    app.run_polling()
+    if BOT_MODE == "webhook":
+        asyncio.run(serve_webhook(app))
+    else:
+        app.run_polling()
 
 
 if __name__ == "__main__":
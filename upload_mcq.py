@@ -1,30 +1,170 @@
-import csv
-import sqlite3
-
-conn = sqlite3.connect("mcq.db")
-cur = conn.cursor()
-
-with open("mcq_upload.csv", "r", encoding="utf-8") as f:
-    reader = csv.DictReader(f)
-    for row in reader:
-        cur.execute("""
-        INSERT INTO mcq
-        (exam, topic, question, a, b, c, d, correct, explanation)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            row["exam"],
-            row["topic"],
-            row["question"],
-            row["a"],
-            row["b"],
-            row["c"],
-            row["d"],
-            row["correct"],
-            row["explanation"]
-        ))
-
-conn.commit()
-conn.close()
-
-print("✅ CSV imported successfully")
+"""
+Bulk MCQ loader for large question banks.
 
+    python upload_mcq.py                          # mcq_upload.csv → mcq.db
+    python upload_mcq.py bank.xlsx --batch-size 20000
+    python upload_mcq.py bank.csv --restart       # ignore checkpoint
+
+- Streams CSV / XLSX files of any size (constant memory)
+- Same validation + duplicate detection as the bot's Excel upload
+- One transaction per batch; rejected rows go to <file>.rejects.csv
+- Resumable: progress is checkpointed after every committed batch,
+  so re-running the same command continues where it stopped
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+from bot_mcq import (
+    DB_PATH,
+    IMPORT_BATCH_SIZE,
+    REQUIRED_EXCEL_COLUMNS,
+    bump_catalog_version,
+    import_mcq_frame,
+    iter_sheet_chunks,
+    migrate,
+    normalize_mcq_frame,
+    open_connection,
+    read_header,
+)
+
+
+# ================= CHECKPOINT =================
+
+def file_identity(path):
+    st = os.stat(path)
+    return {"source": os.path.abspath(path), "size": st.st_size, "mtime": st.st_mtime}
+
+
+def load_checkpoint(path, identity):
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if {k: data.get(k) for k in identity} != identity:
+        return None
+    return data
+
+
+def save_checkpoint(path, data):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+# ================= LOADER =================
+
+def write_rejects(path, frame):
+    if frame.empty:
+        return
+    frame.to_csv(
+        path,
+        mode="a",
+        index=False,
+        header=not os.path.exists(path),
+        encoding="utf-8",
+    )
+
+
+def load(args):
+    missing = [c for c in REQUIRED_EXCEL_COLUMNS if c not in read_header(args.file)]
+    if missing:
+        sys.exit(f"❌ Missing required columns: {', '.join(missing)}")
+
+    identity = file_identity(args.file)
+    state = None if args.restart else load_checkpoint(args.checkpoint, identity)
+
+    if state:
+        print(f"↻ Resuming after row {state['rows']:,}")
+    else:
+        state = dict(identity, rows=0, added=0, skipped=0, rejected=0)
+        if os.path.exists(args.rejects):
+            os.remove(args.rejects)
+
+    conn = open_connection(args.db)
+    migrate(conn)
+
+    existing = {}       # (exam, topic) -> questions, shared across batches
+    started = time.perf_counter()
+    done_here = 0
+
+    try:
+        for chunk in iter_sheet_chunks(args.file, args.batch_size, skip=state["rows"]):
+            valid, rejected = normalize_mcq_frame(chunk)
+
+            try:
+                added, duplicates = import_mcq_frame(
+                    conn, valid, args.batch_size, existing
+                )
+                if added:
+                    bump_catalog_version(conn)
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+
+            write_rejects(args.rejects, rejected)
+
+            state["rows"] += len(chunk)
+            state["added"] += added
+            state["skipped"] += len(duplicates)
+            state["rejected"] += len(rejected)
+            save_checkpoint(args.checkpoint, state)
+
+            done_here += len(chunk)
+            rate = done_here / max(time.perf_counter() - started, 1e-9)
+            print(
+                f"\r{state['rows']:>12,} rows | {rate:>10,.0f} rows/s | "
+                f"added {state['added']:,} | dup {state['skipped']:,} | "
+                f"rejected {state['rejected']:,}",
+                end="",
+                flush=True,
+            )
+    except KeyboardInterrupt:
+        print(f"\n⏸ Interrupted — re-run the same command to resume from row {state['rows']:,}")
+        sys.exit(130)
+    finally:
+        conn.close()
+
+    # Finished: nothing left to resume
+    if os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+
+    elapsed = time.perf_counter() - started
+    print(
+        f"\n✅ Import complete in {elapsed:.1f}s "
+        f"({done_here / max(elapsed, 1e-9):,.0f} rows/s)\n"
+        f"➕ Added: {state['added']:,}\n"
+        f"⏭ Skipped (Duplicate): {state['skipped']:,}\n"
+        f"⚠️ Rejected: {state['rejected']:,}"
+        + (f" → {args.rejects}" if state["rejected"] else "")
+    )
+    print("ℹ️ A running bot picks up the new questions within a few seconds.")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Bulk MCQ loader (CSV / XLSX)")
+    ap.add_argument("file", nargs="?", default="mcq_upload.csv")
+    ap.add_argument("--db", default=DB_PATH, help=f"database (default: {DB_PATH})")
+    ap.add_argument(
+        "--batch-size", type=int, default=IMPORT_BATCH_SIZE,
+        help=f"rows per transaction (default: {IMPORT_BATCH_SIZE})"
+    )
+    ap.add_argument("--rejects", help="rejected rows CSV (default: <file>.rejects.csv)")
+    ap.add_argument("--checkpoint", help="checkpoint file (default: <file>.checkpoint.json)")
+    ap.add_argument("--restart", action="store_true", help="ignore any checkpoint")
+    args = ap.parse_args()
+
+    args.rejects = args.rejects or args.file + ".rejects.csv"
+    args.checkpoint = args.checkpoint or args.file + ".checkpoint.json"
+
+    load(args)
+
+
+if __name__ == "__main__":
+    main()